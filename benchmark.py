@@ -0,0 +1,106 @@
+"""Benchmark TelegramManager.fetch_chats and get_messages against the synthetic Telegram simulator.
+
+Messages are written to DATABASE_URL, so point it at a scratch database, e.g.:
+
+    DATABASE_URL=sqlite:///benchmark.db python benchmark.py --chats 20 --latency 0.05 --flood-every 25
+"""
+import argparse
+import asyncio
+import math
+import time
+import pytz
+from simulator import SimulatedClient
+from telegram_client import TelegramManager
+from database import setup_database, delete_messages
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+BENCHMARK_PHONE = "+0000000000"
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of values (fraction between 0 and 1)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def report(name, latencies, items):
+    """Print throughput and latency percentiles of one operation."""
+    total = sum(latencies)
+    throughput = items / total if total else 0.0
+    print(f"{name:<14} calls={len(latencies):<5} items={items:<7} {throughput:>9.1f} items/s  "
+          f"p50={percentile(latencies, 0.5) * 1000:>8.1f} ms  p99={percentile(latencies, 0.99) * 1000:>8.1f} ms")
+
+
+async def run(args):
+    """Run the benchmark and print its results."""
+    setup_database()
+    client = SimulatedClient(chats=args.chats, messages_per_chat=args.messages, latency=args.latency,
+                             jitter=args.jitter, page_size=args.page_size, flood_every=args.flood_every,
+                             flood_seconds=args.flood_seconds, seed=args.seed)
+    telegram = TelegramManager(BENCHMARK_PHONE, 0, "", client=client)
+    await telegram.connect()
+    await telegram.login(BENCHMARK_PHONE)
+
+    chat_latencies, message_latencies = [], []
+    chat_count = message_count = 0
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        chats = await telegram.fetch_chats()
+        chat_latencies.append(time.perf_counter() - start)
+        chat_count += len(chats)
+
+        for chat_id, _, _ in chats:
+            if args.cold:
+                delete_messages(chat_id, BENCHMARK_PHONE, delete_all=True)
+            start = time.perf_counter()
+            messages = await telegram.get_messages(chat_id, args.filter_type, args.filter_value, pytz.UTC,
+                                                   BENCHMARK_PHONE)
+            message_latencies.append(time.perf_counter() - start)
+            message_count += len(messages)
+    elapsed = time.perf_counter() - started
+    await telegram.disconnect()
+
+    print(f"{args.runs} runs over {args.chats} chats in {elapsed:.2f} s, {client.requests} requests, "
+          f"{client.flood_waits} flood waits")
+    report("fetch_chats", chat_latencies, chat_count)
+    report("get_messages", message_latencies, message_count)
+    limiter = telegram.rate_limiter_stats()
+    cache = telegram.sender_cache_stats()
+    print(f"rate limiter: {limiter['rate']:.2f}/{limiter['max_rate']:.2f} requests/s, "
+          f"waited {limiter['total_wait']:.2f} s; sender cache hit rate {cache['hit_rate']:.0%}, "
+          f"senders resolved from pages/in bulk/one at a time: "
+          f"{cache['resolved']['page']}/{cache['resolved']['bulk']}/{cache['resolved']['single']}")
+
+
+def main():
+    """Parse the command line and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=1000, help="messages per chat")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds per request")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--flood-every", type=int, default=0, help="raise a flood wait every N requests")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--filter-type", default="recent_messages",
+                        choices=["recent_messages", "recent_days", "specific_date"])
+    parser.add_argument("--filter-value", default="300")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--cold", action="store_true", help="delete stored messages before every fetch")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.filter_type != "specific_date":
+        args.filter_value = int(args.filter_value)
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
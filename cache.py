@@ -0,0 +1,127 @@
+import time
+from collections import OrderedDict
+
+
+class SenderCache:
+    """Bounded LRU cache of sender entities keyed by sender ID, with a per-entry TTL."""
+
+    def __init__(self, max_size, ttl):
+        """Initialize an empty cache holding at most max_size entities for ttl seconds each."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # sender_id -> (entity, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sender_id):
+        """Return the cached entity for sender_id, or None if it is missing or expired."""
+        entry = self._entries.get(sender_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        entity, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[sender_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(sender_id)
+        self.hits += 1
+        return entity
+
+    def record_miss(self):
+        """Count a lookup that was answered by fetching the entity rather than by get()."""
+        self.misses += 1
+
+    def put(self, sender_id, entity):
+        """Store an entity under sender_id, evicting the least recently used entries if full."""
+        if sender_id is None or entity is None:
+            return
+        self._entries[sender_id] = (entity, time.monotonic() + self.ttl)
+        self._entries.move_to_end(sender_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all cached entities and reset the hit/miss counters."""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return cache size and hit/miss counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __contains__(self, sender_id):
+        entry = self._entries.get(sender_id)
+        return entry is not None and entry[1] >= time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DialogSnapshot:
+    """In-memory snapshot of a user's private chats in Telegram's dialog order, with a freshness TTL."""
+
+    def __init__(self, ttl):
+        """Initialize an empty snapshot that stays fresh for ttl seconds after each refresh."""
+        self.ttl = ttl
+        self._chats = OrderedDict()  # chat_id -> ((chat_id, name, username), dialog_date)
+        self.latest_date = None  # Date of the newest non-pinned dialog seen so far
+        self.refreshed_at = None
+        self.loaded = False  # Whether a full dialog scan has populated the snapshot
+
+    def is_fresh(self):
+        """Whether the snapshot was refreshed less than ttl seconds ago."""
+        return self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.ttl
+
+    def replace(self, entries, latest_date):
+        """Replace the whole snapshot with (chat, dialog_date) entries from a full dialog scan."""
+        self._chats = OrderedDict((chat[0], (chat, date))
+                                  for chat, date in entries)
+        self.latest_date = latest_date
+        self.refreshed_at = time.monotonic()
+        self.loaded = True
+
+    def merge(self, entries, latest_date):
+        """Move (chat, dialog_date) entries from an incremental scan to the front of the snapshot."""
+        for chat, date in reversed(entries):
+            self._chats[chat[0]] = (chat, date)
+            self._chats.move_to_end(chat[0], last=False)
+        if latest_date is not None and (self.latest_date is None or latest_date > self.latest_date):
+            self.latest_date = latest_date
+        self.refreshed_at = time.monotonic()
+
+    def invalidate(self):
+        """Mark the snapshot stale so the next access refreshes it incrementally."""
+        self.refreshed_at = None
+
+    def chats(self):
+        """Return all chats as (chat_id, name, username) tuples in dialog order."""
+        return [chat for chat, _ in self._chats.values()]
+
+    def chats_since(self, timestamp):
+        """Return chats whose last activity is newer than timestamp (all chats if timestamp is None)."""
+        if timestamp is None:
+            return self.chats()
+        return [chat for chat, date in self._chats.values() if date is not None and date > timestamp]
+
+    def search(self, search_term):
+        """Match chats by exact @username, or by exact ID or name substring (case-insensitive)."""
+        search_term_lower = search_term.lower()
+        if search_term_lower.startswith('@'):
+            search_term_clean = search_term_lower[1:]
+            if not search_term_clean:
+                return []
+            return [chat for chat, _ in self._chats.values()
+                    if chat[2] and chat[2].lower() == search_term_clean]
+        return [chat for chat, _ in self._chats.values()
+                if search_term_lower == str(chat[0]) or search_term_lower in chat[1].lower()]
+
+    def __len__(self):
+        return len(self._chats)
@@ -0,0 +1,284 @@
+import asyncio
+import base64
+import gzip
+import json
+import time
+from datetime import datetime
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.extensions import BinaryReader
+from telethon.tl.custom import Dialog
+from telethon._updates import EntityCache
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+
+class CassetteError(Exception):
+    """Raised when a replayed call was not recorded in the cassette."""
+
+
+def _encode(tl_object):
+    """Serialize a TL object to base64 text."""
+    return base64.b64encode(bytes(tl_object)).decode()
+
+
+def _decode(data):
+    """Deserialize a TL object from base64 text."""
+    return BinaryReader(base64.b64decode(data)).tgread_object()
+
+
+def _call_key(method, **kwargs):
+    """Return the key identifying a call by method name and arguments."""
+    args = {name: value.isoformat() if isinstance(value, datetime) else value
+            for name, value in kwargs.items()}
+    return json.dumps([method, args], sort_keys=True, default=str)
+
+
+class Cassette:
+    """Recorded Telegram responses: calls by key, each a list of events, plus the entities they reference."""
+
+    def __init__(self, me=None, calls=None, entities=None):
+        """Initialize a cassette; me, calls and entities hold encoded TL objects."""
+        self.me = me
+        self.calls = calls or {}  # call key -> list of recordings, each a list of events
+        self.entities = entities or {}  # marked peer ID -> encoded entity
+
+    def add_entities(self, *entities):
+        """Store entities referenced by recorded events, returning their peer IDs."""
+        peer_ids = []
+        for entity in entities:
+            if entity is None:
+                continue
+            peer_id = utils.get_peer_id(entity)
+            self.entities[str(peer_id)] = _encode(entity)
+            peer_ids.append(peer_id)
+        return peer_ids
+
+    def save(self, path):
+        """Write the cassette as gzip-compressed JSON."""
+        data = {"version": CASSETTE_VERSION, "me": self.me,
+                "calls": self.calls, "entities": self.entities}
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        logger.info(
+            f"Saved cassette with {sum(len(r) for r in self.calls.values())} calls to {path}")
+
+    @classmethod
+    def load(cls, path):
+        """Read a cassette written by save."""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CASSETTE_VERSION:
+            raise CassetteError(
+                f"Unsupported cassette version {data.get('version')} in {path}")
+        return cls(data["me"], data["calls"], data["entities"])
+
+
+class RecordingClient:
+    """Wraps a TelegramClient and records the responses TelegramManager reads from it.
+
+    Everything else is passed through to the wrapped client. The cassette is written on disconnect.
+    """
+
+    def __init__(self, client, path):
+        """Wrap client, recording to the cassette file at path."""
+        self._client = client
+        self.path = path
+        self.cassette = Cassette()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def __setattr__(self, name, value):
+        if name in ("_client", "path", "cassette"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._client, name, value)
+
+    def _record(self, key, events):
+        """Append a finished recording of a call."""
+        self.cassette.calls.setdefault(key, []).append(events)
+
+    async def _record_stream(self, key, iterator, encode):
+        """Record every item of an async iterator with the time spent waiting for it, and any flood wait that ends it.
+
+        Time the consumer spends between items is not counted as latency.
+        """
+        events = []
+        last = time.monotonic()
+        try:
+            async for item in iterator:
+                event = encode(item)
+                event["t"] = round(time.monotonic() - last, 4)
+                events.append(event)
+                yield item
+                last = time.monotonic()
+        except FloodWaitError as e:
+            events.append(
+                {"t": round(time.monotonic() - last, 4), "flood": e.seconds})
+            raise
+        finally:
+            self._record(key, events)
+
+    def _encode_message(self, message):
+        """Encode a message with the IDs of the sender and chat it references."""
+        return {"message": _encode(message),
+                "entities": self.cassette.add_entities(message.sender, message.chat)}
+
+    def _encode_dialog(self, dialog):
+        """Encode a dialog with its last message and entity."""
+        event = {"dialog": _encode(dialog.dialog),
+                 "entities": self.cassette.add_entities(dialog.entity)}
+        if dialog.message is not None:
+            event["message"] = self._encode_message(dialog.message)
+        return event
+
+    def iter_messages(self, entity, **kwargs):
+        """Iterate over messages, recording them."""
+        key = _call_key("iter_messages", entity=entity, **
+                        {k: v for k, v in kwargs.items() if k != "wait_time"})
+        return self._record_stream(key, self._client.iter_messages(entity, **kwargs), self._encode_message)
+
+    def iter_dialogs(self, **kwargs):
+        """Iterate over dialogs, recording them."""
+        key = _call_key("iter_dialogs", **kwargs)
+        return self._record_stream(key, self._client.iter_dialogs(**kwargs), self._encode_dialog)
+
+    async def get_entity(self, entity):
+        """Get one or more entities, recording the result."""
+        key = _call_key("get_entity", entity=entity)
+        start = time.monotonic()
+        try:
+            result = await self._client.get_entity(entity)
+        except FloodWaitError as e:
+            self._record(
+                key, [{"t": round(time.monotonic() - start, 4), "flood": e.seconds}])
+            raise
+        entities = result if isinstance(result, list) else [result]
+        self._record(key, [{"t": round(time.monotonic() - start, 4),
+                            "entities": self.cassette.add_entities(*entities),
+                            "list": isinstance(result, list)}])
+        return result
+
+    async def get_me(self, *args, **kwargs):
+        """Get the logged-in user, recording it."""
+        me = await self._client.get_me(*args, **kwargs)
+        if me is not None:
+            self.cassette.me = _encode(me)
+        return me
+
+    async def disconnect(self):
+        """Disconnect the wrapped client and write the cassette."""
+        try:
+            await self._client.disconnect()
+        finally:
+            self.cassette.save(self.path)
+
+
+class ReplayClient:
+    """A stand-in for TelegramClient that replays a cassette, optionally with the recorded latencies.
+
+    Calls are matched by method and arguments and replayed in recording order; a call that was not
+    recorded raises CassetteError.
+    """
+
+    def __init__(self, cassette, latency=False):
+        """Replay cassette, sleeping for the recorded delays if latency is true (or scaled by a number)."""
+        self.cassette = cassette
+        self.latency = float(latency)
+        self.flood_sleep_threshold = 0
+        self.parse_mode = utils.sanitize_parse_mode("md")
+        self._mb_entity_cache = EntityCache()
+        self._entities = {int(peer_id): _decode(data)
+                          for peer_id, data in cassette.entities.items()}
+        self._me = _decode(cassette.me) if cassette.me else None
+        self._self_id = self._me.id if self._me else None
+        self._positions = {}  # call key -> number of recordings replayed
+
+    @classmethod
+    def load(cls, path, latency=False):
+        """Open a replay client for the cassette file at path."""
+        return cls(Cassette.load(path), latency)
+
+    def _next_recording(self, key):
+        """Return the next recording of a call, repeating the last one once all have been replayed."""
+        recordings = self.cassette.calls.get(key)
+        if not recordings:
+            raise CassetteError(f"Call not recorded: {key}")
+        position = self._positions.get(key, 0)
+        self._positions[key] = position + 1
+        return recordings[min(position, len(recordings) - 1)]
+
+    async def _replay_event(self, event):
+        """Wait for an event's recorded delay and raise its flood wait, if any."""
+        if self.latency and event["t"]:
+            await asyncio.sleep(event["t"] * self.latency)
+        if "flood" in event:
+            raise FloodWaitError(None, capture=event["flood"])
+
+    def _entities_for(self, peer_ids):
+        """Return the recorded entities with the given peer IDs, keyed by ID."""
+        return {peer_id: self._entities[peer_id] for peer_id in peer_ids if peer_id in self._entities}
+
+    def _build_message(self, event):
+        """Rebuild a message bound to this client."""
+        message = _decode(event["message"])
+        message._finish_init(
+            self, self._entities_for(event["entities"]), None)
+        return message
+
+    def _build_dialog(self, event):
+        """Rebuild a dialog bound to this client."""
+        message = self._build_message(
+            event["message"]) if "message" in event else None
+        return Dialog(self, _decode(event["dialog"]), self._entities_for(event["entities"]), message)
+
+    async def _replay_stream(self, key, build):
+        """Yield the rebuilt items of a recorded stream."""
+        for event in self._next_recording(key):
+            await self._replay_event(event)
+            yield build(event)
+
+    def iter_messages(self, entity, **kwargs):
+        """Replay a recorded message iteration."""
+        key = _call_key("iter_messages", entity=entity, **
+                        {k: v for k, v in kwargs.items() if k != "wait_time"})
+        return self._replay_stream(key, self._build_message)
+
+    def iter_dialogs(self, **kwargs):
+        """Replay a recorded dialog iteration."""
+        return self._replay_stream(_call_key("iter_dialogs", **kwargs), self._build_dialog)
+
+    async def get_entity(self, entity):
+        """Replay a recorded entity lookup."""
+        event = self._next_recording(_call_key("get_entity", entity=entity))[0]
+        await self._replay_event(event)
+        entities = [self._entities[peer_id] for peer_id in event["entities"]]
+        return entities if event["list"] else entities[0]
+
+    async def get_me(self, *args, **kwargs):
+        """Return the recorded logged-in user."""
+        return self._me
+
+    async def connect(self):
+        """Nothing to connect to."""
+
+    async def disconnect(self):
+        """Nothing to disconnect from."""
+
+    async def is_user_authorized(self):
+        """The recorded session is always authorized."""
+        return True
+
+    async def catch_up(self):
+        """No updates are replayed."""
+
+    def add_event_handler(self, callback, event=None):
+        """Live updates are not replayed."""
+
+    def remove_event_handler(self, callback, event=None):
+        """Live updates are not replayed."""
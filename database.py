@@ -1,13 +1,17 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, UniqueConstraint, BigInteger, text, select, distinct
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, UniqueConstraint, BigInteger, Boolean, Index, text, select, distinct, \
+    inspect, func, insert
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker, Mapped, mapped_column
 try:
     from sqlalchemy.orm import declarative_base
 except ImportError:
     from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
 from datetime import datetime, timedelta
+import re
 import pytz
-from config import MAX_MESSAGES_PER_CHAT, DATABASE_URL, VERBOSE_LOGGING, ENCRYPTION_KEY
+from config import MAX_MESSAGES_PER_CHAT, MESSAGE_MAX_AGE_DAYS, PARTITION_MESSAGES, RETENTION_BATCH_SIZE, INSERT_BATCH_SIZE, MESSAGE_WRITE_MODE, DATABASE_URL, VERBOSE_LOGGING, ENCRYPTION_KEY
+from utils import MessageRow, content_hash
 import logging
 from cryptography.fernet import Fernet
 import base64
@@ -65,10 +69,61 @@ class Message(Base):
     text: Mapped[str | None] = mapped_column(String)
     timestamp: Mapped[datetime] = mapped_column(DateTime)
     user_phone: Mapped[str] = mapped_column(String, nullable=False)
+    media_type: Mapped[str | None] = mapped_column(String(16))  # e.g. "photo", "voice"; None for text
+    media_size: Mapped[int | None] = mapped_column(BigInteger)  # Bytes
+    media_duration: Mapped[int | None] = mapped_column(Integer)  # Seconds
+    edit_date: Mapped[datetime | None] = mapped_column(DateTime)  # When the stored content was last edited
+    content_hash: Mapped[str | None] = mapped_column(String(32))  # utils.content_hash of the stored content
     __table_args__ = (UniqueConstraint("chat_id", "message_id",
                       "user_phone", name="uq_message_chat_id_message_id_user_phone"),)
 
 
+class CoverageInterval(Base):
+    """Model for the coverage_intervals table: time and message ID ranges of a chat known to be fully stored."""
+    __tablename__ = "coverage_intervals"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    user_phone: Mapped[str] = mapped_column(String, nullable=False)
+    # Every message sent between these times is stored
+    covered_from: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    covered_to: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # Oldest and newest stored message IDs in the range (None if it holds no messages)
+    min_message_id: Mapped[int | None] = mapped_column(BigInteger)
+    max_message_id: Mapped[int | None] = mapped_column(BigInteger)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    __table_args__ = (Index("ix_coverage_intervals_chat_id_user_phone", "chat_id", "user_phone"),)
+
+
+class BackfillState(Base):
+    """Model for the backfill_state table recording how far a full-history backfill of a chat has progressed."""
+    __tablename__ = "backfill_state"
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_phone: Mapped[str] = mapped_column(String, primary_key=True)
+    # Newest message ID committed so far; the backfill resumes after it
+    last_message_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    completed: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class RetentionPolicy(Base):
+    """Model for the retention_policies table overriding how many and how old messages of a chat are kept."""
+    __tablename__ = "retention_policies"
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_phone: Mapped[str] = mapped_column(String, primary_key=True)
+    # None keeps messages regardless of count or age
+    max_messages: Mapped[int | None] = mapped_column(Integer)
+    max_age_days: Mapped[int | None] = mapped_column(Integer)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class SchemaVersion(Base):
+    """Model for the schema_version table holding the number of the last applied migration."""
+    __tablename__ = "schema_version"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)  # Single row with ID 1
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
 class LastUpdate(Base):
     """Model for the last_update table."""
     __tablename__ = "last_update"
@@ -78,15 +133,208 @@ class LastUpdate(Base):
 
 
 def setup_database():
-    """Initialize the PostgreSQL database and create necessary tables."""
+    """Bring the database schema up to date; does nothing beyond a version check if it already is."""
     try:
-        Base.metadata.create_all(engine)
-        logger.info("Database initialized successfully.")
+        version = migrate()
+        if PARTITION_MESSAGES:
+            partition_messages()
+        logger.info(
+            f"Database initialized successfully (schema version {version}).")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
         raise
 
 
+def _create_tables(connection):
+    """Create the tables, adding columns introduced before migrations existed to tables that already did."""
+    Base.metadata.create_all(connection)
+    add_missing_columns(connection, Message)
+
+
+def _add_hot_path_indexes(connection):
+    """Index messages by (user_phone, chat_id, timestamp DESC) and chats by user_phone, plus a BRIN timestamp index."""
+    connection.execute(text(
+        "DROP INDEX IF EXISTS ix_messages_chat_id_user_phone_timestamp"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_user_phone_chat_id_timestamp "
+        "ON messages (user_phone, chat_id, timestamp DESC)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chats_user_phone ON chats (user_phone)"))
+    if connection.dialect.name == "postgresql":
+        # Messages arrive roughly in timestamp order, so a BRIN index serves time-range scans of large tables
+        # for a tiny fraction of a B-tree's size
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_timestamp_brin ON messages USING brin (timestamp)"))
+
+
+# Schema migrations in order; migration n brings the schema to version n. Append only.
+def _reset_coverage(connection):
+    """Clear the coverage index on PostgreSQL, where earlier versions stored it in the server's time zone.
+
+    The index only saves requests, so the next fetch of each chat rebuilds it.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(CoverageInterval.__table__.delete())
+
+
+MIGRATIONS = [
+    _create_tables,
+    _add_hot_path_indexes,
+    _reset_coverage,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _schema_version(connection):
+    """Return the schema version of the database, 0 if it was never migrated."""
+    if not inspect(connection).has_table(SchemaVersion.__tablename__):
+        return 0
+    return connection.scalar(select(SchemaVersion.version)) or 0
+
+
+def migrate():
+    """Apply pending migrations, each in its own transaction, and return the resulting schema version."""
+    with engine.connect() as connection:
+        version = _schema_version(connection)
+    if version >= SCHEMA_VERSION:
+        if version > SCHEMA_VERSION:
+            logger.warning(
+                f"Database schema version {version} is newer than this version of the app ({SCHEMA_VERSION})")
+        return version
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(SchemaVersion.__table__.delete())
+            connection.execute(SchemaVersion.__table__.insert().values(
+                id=1, version=number, applied_at=datetime.now(pytz.UTC)))
+        logger.info(
+            f"Applied database migration {number}: {migration.__doc__.splitlines()[0]}")
+    return SCHEMA_VERSION
+
+
+# (year, month) pairs known to have a partition of messages
+_known_partitions = set()
+# Whether messages is partitioned, once checked
+_partitioned = {}
+
+
+def _partition_name(year, month):
+    """Return the name of the partition of messages holding a month."""
+    return f"messages_y{year:04d}m{month:02d}"
+
+
+def _month_bounds(year, month):
+    """Return the naive UTC start of a month and of the month after it."""
+    return datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+
+
+def _messages_partitioned(connection):
+    """Return whether messages is a partitioned table; only PostgreSQL tables can be."""
+    if connection.dialect.name != "postgresql":
+        return False
+    if "messages" not in _partitioned:
+        _partitioned["messages"] = bool(connection.scalar(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))")))
+    return _partitioned["messages"]
+
+
+def _ensure_partitions(connection, months):
+    """Create and attach the monthly partitions of messages for (year, month) pairs that have none yet."""
+    for year, month in sorted(set(months) - _known_partitions):
+        start, end = _month_bounds(year, month)
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {_partition_name(year, month)} PARTITION OF messages "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"))
+        _known_partitions.add((year, month))
+
+
+def partition_messages():
+    """Convert messages into a table range-partitioned by month of timestamp, returning whether it is partitioned.
+
+    Only PostgreSQL supports this. The conversion copies every row once; afterwards this only checks the
+    catalog. Unique keys of a partitioned table must include the partition key, so messages are
+    deduplicated on (chat_id, message_id, user_phone, timestamp); Telegram never changes a message's date.
+    """
+    if engine.dialect.name != "postgresql":
+        logger.warning("Partitioning messages needs PostgreSQL, keeping a single table")
+        return False
+    try:
+        with engine.begin() as connection:
+            if _messages_partitioned(connection):
+                return True
+            sequence = connection.scalar(text("SELECT pg_get_serial_sequence('messages', 'id')"))
+            connection.execute(text("ALTER TABLE messages RENAME TO messages_unpartitioned"))
+            connection.execute(text(
+                "CREATE TABLE messages (LIKE messages_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)"))
+            if sequence:
+                # Keep the ID sequence when the old table is dropped
+                connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY messages.id"))
+            months = connection.execute(text(
+                "SELECT DISTINCT EXTRACT(YEAR FROM timestamp)::int, EXTRACT(MONTH FROM timestamp)::int "
+                "FROM messages_unpartitioned WHERE timestamp IS NOT NULL")).fetchall()
+            _ensure_partitions(connection, [tuple(month) for month in months])
+            copied = connection.execute(text(
+                "INSERT INTO messages SELECT * FROM messages_unpartitioned WHERE timestamp IS NOT NULL")).rowcount
+            connection.execute(text("DROP TABLE messages_unpartitioned"))
+            # Constraints and indexes on the parent are created on every partition, present and future
+            connection.execute(text("ALTER TABLE messages ADD PRIMARY KEY (id, timestamp)"))
+            connection.execute(text(
+                "ALTER TABLE messages ADD CONSTRAINT uq_message_chat_id_message_id_user_phone_timestamp "
+                "UNIQUE (chat_id, message_id, user_phone, timestamp)"))
+            _add_hot_path_indexes(connection)
+    except Exception:
+        _known_partitions.clear()
+        _partitioned.clear()
+        raise
+    _partitioned["messages"] = True
+    logger.info(
+        f"Partitioned messages by month: {copied} messages in {len(months)} partitions")
+    return True
+
+
+def _drop_expired_partitions(db_session, cutoff):
+    """Drop the monthly partitions of messages that end before cutoff, returning how many were dropped."""
+    names = db_session.scalars(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'messages'::regclass")).all()
+    dropped = 0
+    for name in names:
+        match = re.fullmatch(r"messages_y(\d{4})m(\d{2})", name)
+        if not match:
+            continue
+        year, month = int(match.group(1)), int(match.group(2))
+        if _month_bounds(year, month)[1] <= _utc_naive(cutoff):
+            db_session.execute(text(f"DROP TABLE {name}"))
+            _known_partitions.discard((year, month))
+            dropped += 1
+            logger.info(f"Retention dropped partition {name}")
+    return dropped
+
+
+def _utc_naive(timestamp):
+    """Return a timestamp as naive UTC, the way messages store it.
+
+    Compared with a naive value, the timestamp column is not cast to timestamptz, so PostgreSQL can prune
+    partitions and use indexes at plan time.
+    """
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def add_missing_columns(connection, model):
+    """Add columns that were introduced after a model's table was created; create_all skips existing tables."""
+    existing = {column["name"] for column in inspect(connection).get_columns(model.__tablename__)}
+    for column in model.__table__.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(text(
+            f"ALTER TABLE {model.__tablename__} ADD COLUMN {column.name} {column_type}"))
+        logger.info(
+            f"Added column {column.name} to table {model.__tablename__}")
+
+
 def encrypt_data(data):
     """Encrypt sensitive data (e.g., API_ID, API_HASH)."""
     try:
@@ -307,93 +555,550 @@ def delete_all_search_history(user_phone):
         session.close()
 
 
-def save_messages(db_session, chat_id, user_phone, messages, max_messages_per_chat=MAX_MESSAGES_PER_CHAT):
-    """Save messages to the database, skipping duplicates efficiently."""
-    existing_message_ids = set(
-        row[0] for row in db_session.execute(
-            select(Message.message_id).filter_by(
-                chat_id=chat_id, user_phone=user_phone)
-        ).fetchall()
-    )
+def save_messages(db_session, chat_id, user_phone, messages, write_mode=MESSAGE_WRITE_MODE):
+    """Save messages to the database, skipping duplicates, and return (inserted, duplicates).
 
-    new_messages_count = 0
-    duplicate_count = 0
-    total_messages = len(messages)
+    write_mode "insert" writes multi-row INSERTs; "copy" streams the rows through a staging table with COPY,
+    which is much faster for large imports on PostgreSQL (other backends fall back to "insert").
+    Old messages are trimmed separately by enforce_retention.
+    """
+    if not isinstance(chat_id, int):
+        logger.error(f"Invalid chat_id: {chat_id}")
+        return 0, 0
 
-    for i, (sender, message_text, timestamp, message_id) in enumerate(messages):
-        if message_id in existing_message_ids:
-            duplicate_count += 1
-            if VERBOSE_LOGGING:
-                logger.debug(
-                    f"Skipped duplicate message ID {message_id} for chat ID {chat_id}")
+    # Validate in one pass; rows repeated within the batch count as duplicates
+    rows = []
+    seen_ids = set()
+    duplicate_count = 0
+    for i, row in enumerate(messages):
+        _, _, timestamp, message_id = row
+        if not isinstance(message_id, (int, type(None))):
+            logger.error(f"Error adding message {i+1}: Invalid message_id: {message_id}")
             continue
-
-        try:
-            sender = str(sender) if sender is not None else "Unknown"
-            message_text = str(
-                message_text) if message_text is not None else None
-            if not isinstance(message_id, (int, type(None))):
-                raise ValueError(f"Invalid message_id: {message_id}")
-            if not isinstance(chat_id, int):
-                raise ValueError(f"Invalid chat_id: {chat_id}")
-            if timestamp.tzinfo is None:
-                logger.warning(
-                    f"Naive timestamp detected for message ID {message_id}, making aware")
-                timestamp = timestamp.replace(tzinfo=pytz.UTC)
-
-            message = Message(
-                message_id=message_id,
-                chat_id=chat_id,
-                sender=sender,
-                text=message_text,
-                timestamp=timestamp,
-                user_phone=user_phone
-            )
-            db_session.add(message)
-            db_session.flush()
-            new_messages_count += 1
-
-            if VERBOSE_LOGGING:
-                logger.debug(
-                    f"Added message {i+1}/{total_messages}: {sender}: {message_text} (ID: {message_id}, {timestamp})")
-
-        except IntegrityError as ie:
-            db_session.rollback()
+        if message_id in seen_ids:
             duplicate_count += 1
-            logger.warning(
-                f"Duplicate message ID {message_id} for chat ID {chat_id}: {ie}")
-            continue
-        except Exception as e:
-            db_session.rollback()
-            logger.error(f"Error adding message {i+1}: {e}")
             continue
+        seen_ids.add(message_id)
+        if timestamp.tzinfo is None:
+            logger.warning(
+                f"Naive timestamp detected for message ID {message_id}, making aware")
+            timestamp = timestamp.replace(tzinfo=pytz.UTC)
+        # Timestamps are stored as naive UTC on every write path
+        rows.append({"message_id": message_id, "chat_id": chat_id, "timestamp": _utc_naive(timestamp),
+                     "user_phone": user_phone, **_content_fields(row)})
+
+    new_messages_count = 0
+    try:
+        if rows and _messages_partitioned(db_session.connection()):
+            _ensure_partitions(db_session.connection(), {(timestamp.year, timestamp.month) for timestamp in
+                                                         (row["timestamp"] for row in rows)})
+        if write_mode == "copy" and _supports_copy(db_session):
+            new_messages_count = _copy_new_rows(db_session, rows)
+        else:
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                new_messages_count += _insert_new_rows(
+                    db_session, chat_id, user_phone, rows[start:start + INSERT_BATCH_SIZE])
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        # Partitions created in the rolled back transaction are gone again
+        _known_partitions.clear()
+        logger.error(f"Error committing messages for chat ID {chat_id}: {e}")
+        raise
+    duplicate_count += len(rows) - new_messages_count
 
     if new_messages_count > 0:
-        try:
-            db_session.commit()
-            db_session.execute(text("""
-                DELETE FROM messages 
-                WHERE chat_id = :chat_id AND user_phone = :user_phone AND id NOT IN (
-                    SELECT id FROM messages 
-                    WHERE chat_id = :chat_id AND user_phone = :user_phone 
-                    ORDER BY timestamp DESC 
-                    LIMIT :limit
-                )
-            """), {"chat_id": chat_id, "user_phone": user_phone, "limit": max_messages_per_chat})
-            db_session.commit()
-            logger.info(
-                f"Added {new_messages_count} new messages for chat ID {chat_id}")
-        except Exception as e:
-            db_session.rollback()
-            logger.error(
-                f"Error committing messages for chat ID {chat_id}: {e}")
+        logger.info(
+            f"Added {new_messages_count} new messages for chat ID {chat_id}")
     else:
         logger.info(f"No new messages to save for chat ID {chat_id}")
 
     if duplicate_count > 0:
         logger.info(
             f"Skipped {duplicate_count} duplicate messages for chat ID {chat_id}")
-    return new_messages_count
+    return new_messages_count, duplicate_count
+
+
+def _message_key(connection):
+    """Return the columns of the unique key that identifies a stored message."""
+    if _messages_partitioned(connection):
+        return ["chat_id", "message_id", "user_phone", "timestamp"]
+    return ["chat_id", "message_id", "user_phone"]
+
+
+# Dialect-specific INSERT constructs supporting ON CONFLICT DO NOTHING
+CONFLICT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def _insert_new_rows(db_session, chat_id, user_phone, rows):
+    """Insert message rows of one chat in a single statement, skipping stored ones; returns how many were inserted."""
+    if not rows:
+        return 0
+    conflict_insert = CONFLICT_INSERTS.get(db_session.get_bind().dialect.name)
+    if conflict_insert is not None:
+        # Executed with a parameter list, the cached statement is sent as multi-row VALUES batches
+        statement = conflict_insert(Message.__table__).on_conflict_do_nothing(
+            index_elements=_message_key(db_session.connection())).returning(Message.__table__.c.id)
+        return len(db_session.connection().execute(statement, rows).fetchall())
+
+    # Other backends: look up which of the IDs are stored, then insert the rest in one executemany
+    existing_message_ids = set(db_session.scalars(
+        select(Message.message_id).where(
+            Message.chat_id == chat_id, Message.user_phone == user_phone,
+            Message.message_id.in_([row["message_id"] for row in rows]))
+    ))
+    new_rows = [row for row in rows if row["message_id"] not in existing_message_ids]
+    if new_rows:
+        db_session.connection().execute(insert(Message.__table__), new_rows)
+    return len(new_rows)
+
+
+# Columns written by the COPY loader, in the order of its text rows
+COPY_COLUMNS = ("message_id", "chat_id", "sender", "text", "timestamp", "user_phone", "media_type", "media_size",
+                "media_duration", "edit_date", "content_hash")
+
+
+def _supports_copy(db_session):
+    """Return whether the session's connection can stream rows with COPY (PostgreSQL through psycopg2)."""
+    dialect = db_session.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def _copy_value(value):
+    """Format a value for COPY's text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        # Same normalization as the INSERT path
+        return _utc_naive(value).isoformat()
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class _CopyStream:
+    """File-like reader producing COPY text rows on demand, so rows are encoded as the driver sends them."""
+
+    def __init__(self, rows):
+        self._lines = ("\t".join(_copy_value(row[column]) for column in COPY_COLUMNS).encode() + b"\n"
+                       for row in rows)
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0 or size > len(self._buffer):
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def _copy_new_rows(db_session, rows):
+    """COPY message rows into a temporary staging table and merge the new ones into messages.
+
+    Returns how many rows were inserted; rows already stored are skipped by the merge.
+    """
+    if not rows:
+        return 0
+    columns = ", ".join(COPY_COLUMNS)
+    connection = db_session.connection()
+    connection.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS message_staging ON COMMIT DELETE ROWS AS
+        SELECT {columns} FROM messages WITH NO DATA
+    """))
+    connection.execute(text("TRUNCATE message_staging"))
+    copy_statement = f"COPY message_staging ({columns}) FROM STDIN"
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(copy_statement, _CopyStream(rows))
+    except connection.dialect.loaded_dbapi.Error as e:
+        # The raw cursor bypasses SQLAlchemy, so wrap its errors like SQLAlchemy would
+        raise DBAPIError.instance(copy_statement, None, e, connection.dialect.loaded_dbapi.Error) from e
+    finally:
+        cursor.close()
+    merged = connection.execute(text(f"""
+        INSERT INTO messages ({columns})
+        SELECT {columns} FROM message_staging
+        ON CONFLICT ({", ".join(_message_key(connection))}) DO NOTHING
+    """))
+    connection.execute(text("TRUNCATE message_staging"))
+    return merged.rowcount
+
+
+def save_retention_policy(chat_id, user_phone, max_messages=None, max_age_days=None):
+    """Set how many and how old messages of a chat are kept; None for both keeps its whole history."""
+    session = Session()
+    try:
+        session.merge(RetentionPolicy(chat_id=chat_id, user_phone=user_phone, max_messages=max_messages,
+                                      max_age_days=max_age_days, updated_at=datetime.now(pytz.UTC)))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error saving retention policy: {e}")
+    finally:
+        session.close()
+
+
+def _retention_cutoff(db_session, chat_id, user_phone, max_messages, max_age_days, now):
+    """Return the timestamp before which a chat's messages are past retention, or None to keep them all.
+
+    The count cutoff is the timestamp of the oldest of the newest max_messages messages, read from the
+    (user_phone, chat_id, timestamp DESC) index; older messages sharing that timestamp are kept too.
+    """
+    cutoff = None
+    if max_messages is not None:
+        cutoff = db_session.scalar(
+            select(Message.timestamp)
+            .where(Message.chat_id == chat_id, Message.user_phone == user_phone)
+            .order_by(Message.timestamp.desc())
+            .offset(max(max_messages - 1, 0))
+            .limit(1)
+        )
+        if cutoff is not None:
+            cutoff = cutoff.replace(tzinfo=pytz.UTC)
+    if max_age_days:
+        age_cutoff = now - timedelta(days=max_age_days)
+        cutoff = max(cutoff, age_cutoff) if cutoff is not None else age_cutoff
+    return cutoff
+
+
+def enforce_retention(max_messages=MAX_MESSAGES_PER_CHAT, max_age_days=MESSAGE_MAX_AGE_DAYS,
+                      batch_size=RETENTION_BATCH_SIZE):
+    """Delete messages past their chat's retention policy (or the given defaults) in batches of batch_size.
+
+    Every batch is committed on its own, so writers are never blocked for long. Returns the number of
+    messages deleted.
+    """
+    session = Session()
+    deleted_count = 0
+    try:
+        policies = {(policy.chat_id, policy.user_phone): (policy.max_messages, policy.max_age_days)
+                    for policy in session.query(RetentionPolicy)}
+        chats = session.execute(
+            select(Message.chat_id, Message.user_phone).distinct()).fetchall()
+        now = datetime.now(pytz.UTC)
+        cutoffs = []
+        for chat_id, user_phone in chats:
+            chat_max_messages, chat_max_age_days = policies.get(
+                (chat_id, user_phone), (max_messages, max_age_days))
+            cutoffs.append((chat_id, user_phone, _retention_cutoff(
+                session, chat_id, user_phone, chat_max_messages, chat_max_age_days, now)))
+
+        if cutoffs and all(cutoff is not None for _, _, cutoff in cutoffs) and \
+                _messages_partitioned(session.connection()):
+            # Months past every chat's cutoff are dropped whole instead of deleted row by row
+            if _drop_expired_partitions(session, min(cutoff for _, _, cutoff in cutoffs)):
+                for chat_id, user_phone, _ in cutoffs:
+                    _clamp_coverage(session, chat_id, user_phone)
+            session.commit()
+
+        for chat_id, user_phone, cutoff in cutoffs:
+            if cutoff is None:
+                continue
+            chat_deleted = 0
+            while True:
+                ids = session.scalars(
+                    select(Message.id)
+                    .where(Message.chat_id == chat_id, Message.user_phone == user_phone,
+                           Message.timestamp < _utc_naive(cutoff))
+                    .limit(batch_size)
+                ).all()
+                if not ids:
+                    break
+                # The timestamp bound confines the delete to the partitions holding the batch
+                chat_deleted += session.query(Message).filter(
+                    Message.id.in_(ids), Message.timestamp < _utc_naive(cutoff)).delete(synchronize_session=False)
+                session.commit()
+            if chat_deleted:
+                _clamp_coverage(session, chat_id, user_phone)
+                session.commit()
+                deleted_count += chat_deleted
+                logger.info(
+                    f"Retention removed {chat_deleted} messages from chat ID {chat_id}")
+        return deleted_count
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error enforcing retention: {e}")
+        return deleted_count
+    finally:
+        session.close()
+
+
+def _clamp_coverage(db_session, chat_id, user_phone):
+    """Shrink a chat's coverage intervals to the messages that survived retention trimming."""
+    oldest = db_session.execute(
+        select(Message.message_id, Message.timestamp)
+        .filter_by(chat_id=chat_id, user_phone=user_phone)
+        .order_by(Message.timestamp.asc())
+        .limit(1)
+    ).first()
+    query = db_session.query(CoverageInterval).filter_by(
+        chat_id=chat_id, user_phone=user_phone)
+    if oldest is None:
+        query.delete(synchronize_session=False)
+        return
+    # Message timestamps and coverage are both stored as naive UTC
+    query.filter(CoverageInterval.covered_to < oldest.timestamp).delete(
+        synchronize_session=False)
+    for interval in query.filter(CoverageInterval.covered_from < oldest.timestamp):
+        interval.covered_from = oldest.timestamp
+        interval.min_message_id = oldest.message_id
+
+
+def _coverage_tuple(interval):
+    """Return a coverage interval as a (covered_from, covered_to, min_message_id, max_message_id) tuple.
+
+    Coverage is stored as naive UTC like message timestamps; the returned times are aware.
+    """
+    return (interval.covered_from.replace(tzinfo=pytz.UTC), interval.covered_to.replace(tzinfo=pytz.UTC),
+            interval.min_message_id, interval.max_message_id)
+
+
+def load_coverage(chat_id, user_phone):
+    """Load a chat's fully stored ranges as (covered_from, covered_to, min_message_id, max_message_id) tuples."""
+    session = Session()
+    try:
+        intervals = session.query(CoverageInterval).filter_by(
+            chat_id=chat_id, user_phone=user_phone).order_by(CoverageInterval.covered_from)
+        return [_coverage_tuple(interval) for interval in intervals]
+    except Exception as e:
+        logger.error(f"Error loading coverage: {e}")
+        return []
+    finally:
+        session.close()
+
+
+def add_coverage(chat_id, user_phone, covered_from, covered_to, min_message_id=None, max_message_id=None):
+    """Record that every message of a chat between two times is stored, merging overlapping intervals."""
+    covered_from = _utc_naive(covered_from)
+    covered_to = _utc_naive(covered_to)
+    session = Session()
+    try:
+        overlapping = session.query(CoverageInterval).filter(
+            CoverageInterval.chat_id == chat_id,
+            CoverageInterval.user_phone == user_phone,
+            CoverageInterval.covered_from <= covered_to,
+            CoverageInterval.covered_to >= covered_from
+        ).all()
+        for interval in overlapping:
+            covered_from = min(covered_from, interval.covered_from)
+            covered_to = max(covered_to, interval.covered_to)
+            min_message_id = min(
+                (i for i in (min_message_id, interval.min_message_id) if i is not None), default=None)
+            max_message_id = max(
+                (i for i in (max_message_id, interval.max_message_id) if i is not None), default=None)
+            session.delete(interval)
+        session.add(CoverageInterval(
+            chat_id=chat_id,
+            user_phone=user_phone,
+            covered_from=covered_from,
+            covered_to=covered_to,
+            min_message_id=min_message_id,
+            max_message_id=max_message_id,
+            updated_at=_utc_naive(datetime.now(pytz.UTC))
+        ))
+        session.commit()
+        if VERBOSE_LOGGING:
+            logger.debug(
+                f"Chat ID {chat_id} covered from {covered_from} to {covered_to} (merged {len(overlapping)})")
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error saving coverage: {e}")
+    finally:
+        session.close()
+
+
+def count_messages(chat_id, user_phone, min_date=None, max_date=None):
+    """Count the stored messages of a chat, optionally only those sent between two times."""
+    session = Session()
+    try:
+        query = session.query(func.count(Message.id)).filter_by(
+            chat_id=chat_id, user_phone=user_phone)
+        if min_date is not None:
+            query = query.filter(Message.timestamp >= _utc_naive(min_date))
+        if max_date is not None:
+            query = query.filter(Message.timestamp <= _utc_naive(max_date))
+        return query.scalar()
+    except Exception as e:
+        logger.error(f"Error counting messages: {e}")
+        return 0
+    finally:
+        session.close()
+
+
+def _content_fields(row):
+    """Return the content columns of a message row: sender, text, media, edit date and content hash."""
+    sender, message_text, _, _ = row
+    media_meta = getattr(row, "media_meta", None) or {}
+    fields = {
+        "sender": str(sender) if sender is not None else "Unknown",
+        "text": str(message_text) if message_text is not None else None,
+        "media_type": getattr(row, "media_type", None),
+        "media_size": media_meta.get("size"),
+        "media_duration": media_meta.get("duration"),
+    }
+    fields["content_hash"] = content_hash(**fields)
+    edit_date = getattr(row, "edit_date", None)
+    fields["edit_date"] = _utc_naive(edit_date) if edit_date is not None else None
+    return fields
+
+
+def update_messages(db_session, chat_id, user_phone, messages):
+    """Overwrite the sender, text and media of already stored messages, e.g. after they were edited."""
+    updated_count = 0
+    for row in messages:
+        updated_count += db_session.query(Message).filter_by(
+            chat_id=chat_id, user_phone=user_phone, message_id=row[3]
+        ).update(_content_fields(row), synchronize_session=False)
+    if updated_count > 0:
+        logger.info(
+            f"Updated {updated_count} edited messages for chat ID {chat_id}")
+    return updated_count
+
+
+def reconcile_messages(db_session, chat_id, user_phone, messages, deleted_range=None):
+    """Bring stored messages in line with freshly fetched rows, returning (updated_count, deleted_count).
+
+    A stored message is rewritten only if its edit date or content hash differs from the fresh row. If
+    deleted_range is a (min_message_id, max_message_id) range the rows were fetched from in full (max may
+    be None for "up to the newest"), stored messages in it that Telegram no longer returned are deleted.
+    """
+    fresh = {row[3]: row for row in messages}
+    query = select(Message.message_id, Message.edit_date, Message.content_hash).where(
+        Message.chat_id == chat_id, Message.user_phone == user_phone)
+    if deleted_range is not None:
+        min_message_id, max_message_id = deleted_range
+        query = query.where(Message.message_id >= min_message_id)
+        if max_message_id is not None:
+            query = query.where(Message.message_id <= max_message_id)
+    elif fresh:
+        query = query.where(Message.message_id.in_(list(fresh)))
+    else:
+        return 0, 0
+
+    changed = []
+    deleted_ids = []
+    for message_id, edit_date, stored_hash in db_session.execute(query).fetchall():
+        row = fresh.get(message_id)
+        if row is None:
+            deleted_ids.append(message_id)
+            continue
+        fresh_edit_date = getattr(row, "edit_date", None)
+        if edit_date is not None and edit_date.tzinfo is None:
+            edit_date = edit_date.replace(tzinfo=pytz.UTC)
+        if fresh_edit_date is not None and fresh_edit_date != edit_date:
+            changed.append(row)
+        elif stored_hash != _content_fields(row)["content_hash"]:
+            # Rows saved before hashing, or content that changed without an edit date (e.g. a renamed sender)
+            changed.append(row)
+
+    updated_count = update_messages(db_session, chat_id, user_phone, changed) if changed else 0
+    deleted_count = 0
+    if deleted_ids:
+        deleted_count = db_session.query(Message).filter(
+            Message.chat_id == chat_id, Message.user_phone == user_phone, Message.message_id.in_(deleted_ids)
+        ).delete(synchronize_session=False)
+        logger.info(
+            f"Removed {deleted_count} messages deleted on Telegram from chat ID {chat_id}")
+    return updated_count, deleted_count
+
+
+def delete_messages_by_id(user_phone, message_ids, chat_id=None):
+    """Delete messages by Telegram message ID, e.g. after a deletion update.
+
+    Telegram does not say which private chat a deletion belongs to, but message IDs are unique per account
+    outside channels, so chat_id may be None.
+    """
+    session = Session()
+    try:
+        query = session.query(Message).filter(
+            Message.user_phone == user_phone, Message.message_id.in_(list(message_ids)))
+        if chat_id is not None:
+            query = query.filter(Message.chat_id == chat_id)
+        deleted_count = query.delete(synchronize_session=False)
+        session.commit()
+        if deleted_count > 0:
+            logger.info(
+                f"Deleted {deleted_count} messages removed on Telegram for user {user_phone}")
+        return deleted_count
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Error deleting messages by ID: {e}")
+        return 0
+    finally:
+        session.close()
+
+
+def save_ingested_messages(chat_id, user_phone, new_messages, edited_messages, live_since=None):
+    """Save messages received as live updates, and advance the chat's high-water mark if it was synced while live."""
+    session = Session()
+    try:
+        if new_messages:
+            save_messages(session, chat_id, user_phone, new_messages)
+        if edited_messages:
+            update_messages(session, chat_id, user_phone, edited_messages)
+        if new_messages and live_since is not None:
+            # Every message after a fetch made while ingestion was running has arrived as an update
+            max_message_id = max(msg[3] for msg in new_messages)
+            head = session.query(CoverageInterval).filter_by(
+                chat_id=chat_id, user_phone=user_phone
+            ).order_by(CoverageInterval.covered_to.desc()).first()
+            if head is not None and head.covered_to >= _utc_naive(live_since):
+                head.covered_to = _utc_naive(datetime.now(pytz.UTC))
+                head.max_message_id = max(
+                    head.max_message_id or 0, max_message_id)
+                head.updated_at = head.covered_to
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error saving ingested messages: {e}")
+        raise
+    finally:
+        session.close()
+
+
+def load_backfill_state(chat_id, user_phone):
+    """Load the progress of a chat's history backfill as (last_message_id, completed), or None if it never ran."""
+    session = Session()
+    try:
+        state = session.get(BackfillState, (chat_id, user_phone))
+        if state is None:
+            return None
+        return state.last_message_id, state.completed
+    except Exception as e:
+        logger.error(f"Error loading backfill state: {e}")
+        return None
+    finally:
+        session.close()
+
+
+def save_backfill_state(chat_id, user_phone, last_message_id, completed=False):
+    """Record the newest message committed by a chat's history backfill."""
+    session = Session()
+    try:
+        session.merge(BackfillState(
+            chat_id=chat_id,
+            user_phone=user_phone,
+            last_message_id=last_message_id,
+            completed=completed,
+            updated_at=datetime.now(pytz.UTC)
+        ))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error saving backfill state: {e}")
+        raise
+    finally:
+        session.close()
 
 
 def load_messages(chat_id, filter_type, filter_value, user_phone, user_timezone=None):
@@ -410,7 +1115,7 @@ def load_messages(chat_id, filter_type, filter_value, user_phone, user_timezone=
             min_date = datetime.now(
                 user_timezone if user_timezone else pytz.UTC) - timedelta(days=filter_value)
             min_date = min_date.astimezone(pytz.UTC)
-            query = query.filter(Message.timestamp >= min_date).order_by(
+            query = query.filter(Message.timestamp >= _utc_naive(min_date)).order_by(
                 Message.timestamp.desc())
         elif filter_type == "specific_date":
             specific_date = datetime.strptime(filter_value, "%d %B %Y")
@@ -425,37 +1130,29 @@ def load_messages(chat_id, filter_type, filter_value, user_phone, user_timezone=
                     hour=0, minute=0, second=0, microsecond=0, tzinfo=pytz.UTC)
                 max_date = min_date + timedelta(days=1) - timedelta(seconds=1)
             query = query.filter(Message.timestamp.between(
-                min_date, max_date)).order_by(Message.timestamp.desc())
+                _utc_naive(min_date), _utc_naive(max_date))).order_by(Message.timestamp.desc())
 
         messages = []
         for msg in query.all():
-            timestamp = msg.timestamp
-            if timestamp.tzinfo is None:
-                logger.warning(
-                    f"Naive timestamp found in database for message ID {msg.message_id}, making aware")
-                timestamp = timestamp.replace(tzinfo=pytz.UTC)
-            messages.append((msg.sender, msg.text, timestamp, msg.message_id))
+            # Timestamps are stored as naive UTC
+            timestamp = msg.timestamp.replace(tzinfo=pytz.UTC)
+            media_meta = {key: value for key, value in (("size", msg.media_size), ("duration", msg.media_duration))
+                          if value is not None}
+            messages.append(MessageRow(msg.sender, msg.text, timestamp, msg.message_id,
+                                       msg.media_type, media_meta))
 
         full_day_covered = False
         latest_timestamp = None
         if messages:
             latest_timestamp = max(msg[2] for msg in messages)
 
-        if filter_type == "specific_date" and messages:
-            timestamps = [msg[2] for msg in messages]
-            timestamps.sort()
-            full_day_covered = True
-            current_time = min_date
-            end_time = max_date
-            i = 0
-            while current_time <= end_time and i < len(timestamps):
-                if timestamps[i] < current_time:
-                    i += 1
-                    continue
-                if timestamps[i] > current_time + timedelta(hours=1):
-                    full_day_covered = False
-                    break
-                current_time += timedelta(hours=1)
+        if filter_type == "specific_date":
+            full_day_covered = session.query(CoverageInterval).filter(
+                CoverageInterval.chat_id == chat_id,
+                CoverageInterval.user_phone == user_phone,
+                CoverageInterval.covered_from <= _utc_naive(min_date),
+                CoverageInterval.covered_to >= _utc_naive(max_date)
+            ).first() is not None
 
         logger.info(
             f"Loaded {len(messages)} messages for chat ID {chat_id}, filter: {filter_type}")
@@ -484,6 +1181,16 @@ def delete_messages(chat_id, user_phone, num_messages=None, specific_date=None,
                 .order_by(Message.timestamp.desc())
                 .limit(num_messages)
             )
+            # Bounding the delete by the oldest of those messages lets the planner skip older partitions
+            oldest = session.scalar(
+                select(Message.timestamp)
+                .where(Message.chat_id == chat_id, Message.user_phone == user_phone)
+                .order_by(Message.timestamp.desc())
+                .offset(max(num_messages - 1, 0))
+                .limit(1)
+            )
+            if oldest is not None:
+                query = query.filter(Message.timestamp >= oldest)
             query = query.filter(Message.id.in_(subquery))
             deleted_count = query.delete(synchronize_session=False)
         elif specific_date is not None:
@@ -498,11 +1205,16 @@ def delete_messages(chat_id, user_phone, num_messages=None, specific_date=None,
                 min_date = specific_date.replace(
                     hour=0, minute=0, second=0, microsecond=0, tzinfo=pytz.UTC)
                 max_date = min_date + timedelta(days=1) - timedelta(seconds=1)
-            query = query.filter(Message.timestamp.between(min_date, max_date))
+            query = query.filter(Message.timestamp.between(
+                _utc_naive(min_date), _utc_naive(max_date)))
             deleted_count = query.delete(synchronize_session=False)
         else:
             deleted_count = 0
 
+        if deleted_count > 0:
+            # The stored history now has holes, so the next fetch must not trust the coverage index
+            session.query(CoverageInterval).filter_by(
+                chat_id=chat_id, user_phone=user_phone).delete()
         session.commit()
         logger.info(f"Deleted {deleted_count} messages for chat ID {chat_id}")
         return deleted_count
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+import pytz
+
+# Start of every chat's history; a coverage interval starting here holds everything up to its end
+HISTORY_START = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+
+class FetchGap:
+    """A range of a chat's history missing from the coverage index, to be fetched newest first.
+
+    The fetch bounds follow Telegram's iteration parameters; the gap records what was fetched so the range
+    can be added to the coverage index once every page of it is stored.
+    """
+
+    def __init__(self, covered_from, covered_to, offset_id=0, offset_date=None, min_id=0, min_date=None,
+                 limit=None):
+        """Initialize a gap between covered_from and covered_to with its fetch bounds."""
+        self.covered_from = covered_from
+        self.covered_to = covered_to
+        self.offset_id = offset_id
+        self.offset_date = offset_date
+        self.min_id = min_id
+        self.min_date = min_date
+        self.limit = limit
+        self.fetched = 0
+        self.min_message_id = None
+        self.max_message_id = None
+        self.oldest = None
+
+    def record(self, rows):
+        """Account for a page of fetched (sender, text, timestamp, message_id) rows."""
+        for _, _, timestamp, message_id in rows:
+            self.fetched += 1
+            if self.max_message_id is None or message_id > self.max_message_id:
+                self.max_message_id = message_id
+            if self.min_message_id is None or message_id < self.min_message_id:
+                self.min_message_id = message_id
+            if self.oldest is None or timestamp < self.oldest:
+                self.oldest = timestamp
+
+    def coverage(self):
+        """Return the (covered_from, covered_to, min_message_id, max_message_id) interval the fetch stored.
+
+        A fetch that stopped at its limit only covers back to the oldest message it returned.
+        """
+        covered_from = self.covered_from
+        if self.limit is not None and self.fetched >= self.limit:
+            covered_from = self.oldest
+        return covered_from, self.covered_to, self.min_message_id, self.max_message_id
+
+
+def extend_live_head(coverage, live_since, now):
+    """Extend the newest interval to now if it was fetched while live ingestion kept the chat current.
+
+    Returns the extended interval, or None if there was nothing to extend.
+    """
+    if not coverage or live_since is None:
+        return None
+    head = max(coverage, key=lambda interval: interval[1])
+    if head[1] < live_since:
+        return None
+    extended = (head[0], now, head[2], head[3])
+    coverage[coverage.index(head)] = extended
+    return extended
+
+
+def plan_window(coverage, window_from, window_to, now):
+    """Return the gaps of [window_from, window_to] missing from the coverage intervals, newest first."""
+    gaps = []
+    top = window_to
+    upper = None  # Interval starting at top, if any
+    for interval in sorted(coverage, key=lambda interval: interval[1], reverse=True):
+        if top <= window_from:
+            break
+        interval_from, interval_to, _, _ = interval
+        if interval_from > top:
+            continue
+        if interval_to < top:
+            if interval_to <= window_from:
+                break
+            gaps.append(_window_gap(interval_to, top, upper, interval, now))
+        top = interval_from
+        upper = interval
+    if top > window_from:
+        gaps.append(_window_gap(window_from, top, upper, None, now))
+    return gaps
+
+
+def _window_gap(gap_from, gap_to, upper, lower, now):
+    """Build the gap between a lower and an upper interval (either may be None)."""
+    offset_id, offset_date = 0, None
+    if gap_to < now:
+        if upper is not None and upper[2] is not None:
+            offset_id = upper[2]
+        else:
+            # offset_date is exclusive, so start one second after the end of the gap
+            offset_date = gap_to + timedelta(seconds=1)
+    min_id = lower[3] if lower is not None and lower[3] is not None else 0
+    return FetchGap(gap_from, min(gap_to, now), offset_id=offset_id, offset_date=offset_date, min_id=min_id,
+                    min_date=gap_from)
+
+
+def plan_recent_messages(coverage, limit, now, count_stored):
+    """Yield the gaps to fetch for a chat's newest limit messages, newest first.
+
+    Each gap is yielded before it is fetched; the next one is planned from how many messages it returned and
+    how many are stored (count_stored(covered_from, covered_to)) in the interval below it, so fetching stops
+    as soon as limit contiguous messages are stored.
+    """
+    intervals = sorted(coverage, key=lambda interval: interval[1], reverse=True)
+    current = intervals[0] if intervals else None
+    stored = 0
+    if current is None or current[1] < now:
+        # Everything newer than the newest interval is missing
+        gap = FetchGap(current[1] if current else HISTORY_START, now, limit=limit)
+        if current is not None:
+            if current[3] is not None:
+                gap.min_id = current[3]
+            else:
+                gap.min_date = current[1]
+        yield gap
+        stored = gap.fetched
+        if gap.fetched >= limit or current is None:
+            return
+
+    for index in range(len(intervals)):
+        current = intervals[index]
+        stored += count_stored(current[0], current[1])
+        if stored >= limit or current[0] <= HISTORY_START:
+            return
+        lower = intervals[index + 1] if index + 1 < len(intervals) else None
+        gap = FetchGap(lower[1] if lower else HISTORY_START, current[0], limit=limit - stored)
+        if current[2] is not None:
+            gap.offset_id = current[2]
+        else:
+            gap.offset_date = current[0]
+        if lower is not None:
+            if lower[3] is not None:
+                gap.min_id = lower[3]
+            else:
+                gap.min_date = lower[1]
+        yield gap
+        stored += gap.fetched
+        if gap.fetched >= gap.limit or lower is None:
+            return
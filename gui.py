@@ -9,7 +9,9 @@ from PyQt6.QtGui import QFont, QIcon
 import asyncio
 import sys
 import qasync
-from telegram_client import TelegramManager
+from session_pool import SessionPool
+from prefetch import PrefetchScheduler
+from retention import RetentionWorker
 from database import (setup_database, save_chats, load_chats, save_search_history, load_search_history,
                       delete_search_history_entry, delete_all_search_history, delete_messages,
                       save_last_update_timestamp, load_last_update_timestamp, load_messages,
@@ -295,12 +297,15 @@ class MainWindow(QMainWindow):
 
         self.statusBar().showMessage("Ready")
 
+        self.session_pool = SessionPool(self)
         self.telegram = None
         self.user_phone = None
         self.user_timezone = None
         self.chats = []
         self.is_fetching = False
         self.fetch_task = None
+        self.prefetcher = None
+        self.retention_worker = RetentionWorker()
         self.current_chat_id = None
         self.current_chat_name = None
         self.progress_dialog = None
@@ -1433,12 +1438,12 @@ class MainWindow(QMainWindow):
                     raise ValueError(
                         f"No API credentials found for {self.user_phone}")
                 api_id, api_hash = credentials
-                self.telegram = TelegramManager(
-                    self.user_phone, api_id, api_hash, self)
-                await self.telegram.connect()
-                user = await self.telegram.login(self.user_phone)
+                # Accounts stay connected in the pool, so switching back to one does not reconnect
+                self.telegram = await self.session_pool.get(self.user_phone)
+                user = self.telegram.me
                 logger.info(f"Logged in as: {user.first_name} ({user.phone})")
                 save_user_settings(self.user_phone, api_id, api_hash)
+                await self.telegram.start_ingestion()
                 return user
             except Exception as e:
                 logger.error(f"Error connecting to Telegram: {e}")
@@ -1476,6 +1481,15 @@ class MainWindow(QMainWindow):
                     logger.info(
                         "Initial chat list fetched successfully from Telegram.")
 
+                # Keep the most active chats synced so fetches are served locally
+                if self.prefetcher:
+                    self.prefetcher.stop()
+                self.prefetcher = PrefetchScheduler(
+                    self.telegram, self.user_phone, self.user_timezone)
+                self.prefetcher.start()
+                # Old messages are trimmed in the background instead of on every save
+                self.retention_worker.start()
+
                 chats_from_db = load_chats(self.user_phone)
                 if chats_from_db:
                     logger.info(
@@ -1643,6 +1657,8 @@ class MainWindow(QMainWindow):
         chat_id = chat[0]
         chat_name = chat[1]
         username = chat[2]
+        if self.prefetcher:
+            self.prefetcher.record_open(chat_id)
 
         search_term = username if username else chat_name
         save_search_history(search_term, self.user_phone)
@@ -1978,9 +1994,12 @@ class MainWindow(QMainWindow):
         self.update_chats()
 
     def closeEvent(self, event):
-        if self.telegram:
+        if self.prefetcher:
+            self.prefetcher.stop()
+        self.retention_worker.stop()
+        if len(self.session_pool):
             async def disconnect_coro():
-                await self.telegram.disconnect()
+                await self.session_pool.disconnect_all()
                 logger.info("Disconnected from Telegram.")
             asyncio.ensure_future(disconnect_coro())
         if queue_handler:
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from collections import Counter
+from config import (PREFETCH_TOP_K, PREFETCH_INTERVAL_SECONDS, PREFETCH_MESSAGES, PREFETCH_RANKING,
+                    PREFETCH_CONCURRENCY, PREFETCH_TICK_SECONDS)
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class PrefetchScheduler:
+    """Keeps the most active chats synced in the background so user fetches are served from the database."""
+
+    def __init__(self, telegram, user_phone, user_timezone, top_k=PREFETCH_TOP_K, interval=PREFETCH_INTERVAL_SECONDS,
+                 ranking=PREFETCH_RANKING):
+        """Initialize a stopped scheduler for the top_k chats of a TelegramManager.
+
+        ranking is "recency" (dialog order) or "frequency" (how often the user opened each chat).
+        """
+        self.telegram = telegram
+        self.user_phone = user_phone
+        self.user_timezone = user_timezone
+        self.top_k = top_k
+        self.interval = interval
+        self.ranking = ranking
+        self.open_counts = Counter()
+        self._next_run = {}  # chat_id -> monotonic time of the next sync
+        self._task = None
+
+    def record_open(self, chat_id):
+        """Count a chat opened by the user, for frequency ranking."""
+        self.open_counts[chat_id] += 1
+
+    def rank_chats(self):
+        """Return the IDs of the chats to keep synced, most important first."""
+        chat_ids = [chat[0] for chat in self.telegram.dialog_snapshot.chats()]
+        if self.ranking == "frequency":
+            # Stable sort keeps dialog recency as the tie-breaker
+            chat_ids.sort(key=lambda chat_id: -self.open_counts[chat_id])
+        return chat_ids[:self.top_k]
+
+    def interval_for(self, rank):
+        """Return the sync interval of the chat at a rank; lower-ranked chats are synced up to half as often."""
+        return self.interval * (1 + rank / max(self.top_k, 1))
+
+    def start(self):
+        """Start syncing in the background."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(
+                f"Prefetch scheduler started for the top {self.top_k} chats ({self.ranking})")
+
+    def stop(self):
+        """Stop syncing."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            logger.info("Prefetch scheduler stopped")
+
+    async def _run(self):
+        """Sync due chats every tick, sitting out ticks while Telegram has asked us to wait."""
+        while True:
+            try:
+                if self.telegram.rate_limiter.stats()["blocked_for"] == 0:
+                    await self.sync_due_chats()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in prefetch scheduler: {e}")
+            await asyncio.sleep(PREFETCH_TICK_SECONDS)
+
+    async def sync_due_chats(self):
+        """Sync every ranked chat whose interval has elapsed."""
+        now = time.monotonic()
+        ranked = self.rank_chats()
+        due = [chat_id for chat_id in ranked if self._next_run.get(
+            chat_id, 0) <= now]
+        if not due:
+            return
+        logger.info(f"Prefetching {len(due)} chats")
+        async for chat_id, messages in self.telegram.fetch_many(due, "recent_messages", PREFETCH_MESSAGES,
+                                                                self.user_timezone, self.user_phone,
+                                                                max_concurrency=PREFETCH_CONCURRENCY):
+            self._next_run[chat_id] = time.monotonic(
+            ) + self.interval_for(ranked.index(chat_id))
+            logger.debug(
+                f"Prefetched {len(messages)} messages for chat ID {chat_id}")
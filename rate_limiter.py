@@ -0,0 +1,105 @@
+import asyncio
+import time
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token-bucket rate limiter shared by all requests of a Telegram client.
+
+    The rate is halved whenever Telegram answers with a new flood wait and grows back towards the configured
+    rate after every recovery_interval seconds without one. Concurrent requests hitting the same wait only
+    extend the block.
+    """
+
+    def __init__(self, rate, burst, min_rate, recovery_interval, backoff=0.5, recovery=1.25):
+        """Initialize a full bucket that refills at rate requests per second."""
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.recovery_interval = recovery_interval
+        self.backoff = backoff
+        self.recovery = recovery
+        self.tokens = float(burst)
+        self.blocked_until = 0.0
+        self.total_wait = 0.0  # Seconds spent waiting for tokens or blocked by flood waits
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        now = time.monotonic()
+        self._updated = now
+        self._last_change = now
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        """Add the tokens earned since the last update and relax the rate if enough time has passed."""
+        if self.rate < self.max_rate and now - self._last_change >= self.recovery_interval:
+            self.rate = min(self.rate * self.recovery, self.max_rate)
+            self._last_change = now
+            logger.info(f"Rate limiter relaxed to {self.rate:.2f} requests/s")
+        self.tokens = min(self.burst, self.tokens +
+                          (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a request may be sent, respecting both the token bucket and any active flood wait."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.blocked_until > now:
+                    # Blocked time is counted once by on_flood_wait
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.total_wait += wait
+                await asyncio.sleep(wait)
+
+    def on_flood_wait(self, seconds):
+        """Block every request for the duration of a flood wait, tightening the rate if it is a new one.
+
+        A flood wait reported while the limiter is already blocked is the same throttling event seen by
+        another request, so it only extends the block.
+        """
+        now = time.monotonic()
+        until = now + seconds
+        if now >= self.blocked_until:
+            self.flood_waits += 1
+            self.flood_wait_seconds += seconds
+            self.total_wait += seconds
+            self.rate = max(self.rate * self.backoff, self.min_rate)
+            logger.warning(
+                f"Flood wait of {seconds} seconds, rate limited to {self.rate:.2f} requests/s")
+        elif until > self.blocked_until:
+            extension = until - self.blocked_until
+            self.flood_wait_seconds += extension
+            self.total_wait += extension
+        else:
+            return
+        self.blocked_until = until
+        self.tokens = 0.0
+        self._updated = max(self._updated, self.blocked_until)
+        # Measure the recovery interval from the end of the wait, not its start
+        self._last_change = self.blocked_until
+
+    async def wait_for_flood(self, seconds):
+        """Record a flood wait and sleep until it has passed."""
+        self.on_flood_wait(seconds)
+        await asyncio.sleep(max(self.blocked_until - time.monotonic(), 0))
+
+    def stats(self):
+        """Return the current rate and wait totals as a dictionary."""
+        return {
+            "rate": self.rate,
+            "max_rate": self.max_rate,
+            "tokens": self.tokens,
+            "total_wait": self.total_wait,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+            "blocked_for": max(self.blocked_until - time.monotonic(), 0),
+        }
@@ -0,0 +1,48 @@
+import asyncio
+from database import enforce_retention
+from config import RETENTION_INTERVAL_SECONDS
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class RetentionWorker:
+    """Trims stored messages to their retention policies in the background, off the message write path."""
+
+    def __init__(self, interval=RETENTION_INTERVAL_SECONDS):
+        """Initialize a stopped worker that runs every interval seconds."""
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        """Start trimming in the background; the first run happens right away."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(
+                f"Retention worker started, running every {self.interval} s")
+
+    def stop(self):
+        """Stop trimming."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            logger.info("Retention worker stopped")
+
+    async def _run(self):
+        """Enforce retention every interval."""
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in retention worker: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Enforce retention once in a worker thread, so the event loop keeps running. Returns messages deleted."""
+        deleted_count = await asyncio.get_event_loop().run_in_executor(None, enforce_retention)
+        if deleted_count:
+            logger.info(f"Retention removed {deleted_count} messages")
+        return deleted_count
@@ -0,0 +1,122 @@
+import asyncio
+from telegram_client import TelegramManager
+from database import load_user_settings, load_all_users
+from config import FETCH_CONCURRENCY
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    """Keeps a connected TelegramManager per account and routes operations to them by user phone.
+
+    Every manager has its own session file and rate limiter, so accounts are synced concurrently without
+    sharing a flood-wait budget.
+    """
+
+    def __init__(self, parent=None):
+        """Initialize an empty pool; parent is passed to new managers for login prompts."""
+        self.parent = parent
+        self.managers = {}  # user_phone -> connected and logged-in TelegramManager
+        self._locks = {}  # user_phone -> lock serializing its connection
+
+    async def get(self, user_phone):
+        """Return the connected manager of an account, connecting and logging in on first use."""
+        manager = self.managers.get(user_phone)
+        if manager is not None:
+            return manager
+        lock = self._locks.setdefault(user_phone, asyncio.Lock())
+        async with lock:
+            if user_phone in self.managers:
+                return self.managers[user_phone]
+            credentials = load_user_settings(user_phone)
+            if not credentials:
+                raise ValueError(f"No API credentials found for {user_phone}")
+            api_id, api_hash = credentials
+            manager = TelegramManager(user_phone, api_id, api_hash, self.parent)
+            await manager.connect()
+            try:
+                await manager.login(user_phone)
+            except Exception:
+                await manager.disconnect()
+                raise
+            self.managers[user_phone] = manager
+            logger.info(f"Added {user_phone} to the session pool")
+            return manager
+
+    async def connect_all(self, user_phones=None):
+        """Connect several accounts (all stored ones by default) concurrently.
+
+        Returns the managers that connected; accounts that failed are logged and left out.
+        """
+        if user_phones is None:
+            user_phones = load_all_users()
+        results = await asyncio.gather(*(self.get(user_phone) for user_phone in user_phones),
+                                       return_exceptions=True)
+        connected = {}
+        for user_phone, result in zip(user_phones, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error connecting {user_phone}: {result}")
+            else:
+                connected[user_phone] = result
+        return connected
+
+    async def sync_accounts(self, filter_type, filter_value, user_timezone, chat_ids_by_phone=None,
+                            max_concurrency=FETCH_CONCURRENCY):
+        """Fetch chats of every pooled account in parallel, yielding (user_phone, chat_id, messages) as they finish.
+
+        chat_ids_by_phone maps accounts to the chats to fetch; by default every chat in each account's
+        dialog list is fetched. max_concurrency applies per account.
+        """
+        if chat_ids_by_phone is None:
+            user_phones = list(self.managers)
+            chat_lists = await asyncio.gather(*(self.managers[user_phone].fetch_chats()
+                                                for user_phone in user_phones))
+            chat_ids_by_phone = {user_phone: [chat[0] for chat in chats]
+                                 for user_phone, chats in zip(user_phones, chat_lists)}
+
+        results = asyncio.Queue()
+
+        async def sync_one(user_phone, chat_ids):
+            try:
+                manager = await self.get(user_phone)
+                async for chat_id, messages in manager.fetch_many(chat_ids, filter_type, filter_value, user_timezone,
+                                                                  user_phone, max_concurrency=max_concurrency):
+                    await results.put((user_phone, chat_id, messages))
+            except Exception as e:
+                logger.error(f"Error syncing {user_phone}: {e}")
+
+        tasks = [asyncio.ensure_future(sync_one(user_phone, chat_ids))
+                 for user_phone, chat_ids in chat_ids_by_phone.items()]
+        done = asyncio.ensure_future(asyncio.gather(*tasks, return_exceptions=True))
+        try:
+            while not (done.done() and results.empty()):
+                getter = asyncio.ensure_future(results.get())
+                await asyncio.wait({getter, done}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+        finally:
+            # Stop the remaining syncs if the caller stops consuming results early
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def disconnect(self, user_phone):
+        """Disconnect an account and remove it from the pool."""
+        manager = self.managers.pop(user_phone, None)
+        if manager is not None:
+            await manager.disconnect()
+            logger.info(f"Removed {user_phone} from the session pool")
+
+    async def disconnect_all(self):
+        """Disconnect every pooled account."""
+        await asyncio.gather(*(self.disconnect(user_phone) for user_phone in list(self.managers)))
+
+    def __contains__(self, user_phone):
+        return user_phone in self.managers
+
+    def __len__(self):
+        return len(self.managers)
@@ -0,0 +1,178 @@
+import asyncio
+import math
+import random
+from datetime import datetime, timedelta
+import pytz
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.tl import types
+from telethon.tl.custom import Dialog
+from telethon._updates import EntityCache
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ME_ID = 1
+FIRST_CHAT_ID = 1000
+
+
+class SimulatedClient:
+    """A Telethon-compatible stand-in for TelegramClient serving synthetic private chats.
+
+    Every request (a page of messages or dialogs, or an entity lookup) sleeps for latency plus up to jitter
+    seconds, pages hold at most page_size items, and every flood_every-th request raises a FloodWaitError
+    of flood_seconds. Messages are generated on demand, so large chats cost no memory.
+    """
+
+    def __init__(self, chats=20, messages_per_chat=1000, latency=0.05, jitter=0.0, page_size=100,
+                 flood_every=0, flood_seconds=1, message_interval=600, media_every=10, seed=0):
+        """Initialize chats of messages_per_chat messages each, sent message_interval seconds apart."""
+        self.chats = chats
+        self.messages_per_chat = messages_per_chat
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.message_interval = timedelta(seconds=message_interval)
+        self.media_every = media_every
+        self.random = random.Random(seed)
+        self.now = datetime.now(pytz.UTC).replace(microsecond=0)
+        self.requests = 0
+        self.flood_waits = 0
+
+        self.flood_sleep_threshold = 0
+        self.parse_mode = utils.sanitize_parse_mode("md")
+        self._mb_entity_cache = EntityCache()
+        self._self_id = ME_ID
+        self.me = types.User(id=ME_ID, is_self=True, access_hash=ME_ID, first_name="Me")
+        self.users = {FIRST_CHAT_ID + i: types.User(id=FIRST_CHAT_ID + i, access_hash=FIRST_CHAT_ID + i,
+                                                    first_name=f"User {i}", username=f"user{i}")
+                      for i in range(chats)}
+        self.users[ME_ID] = self.me
+
+    async def _request(self):
+        """Simulate the round trip of one request, raising a flood wait when the schedule says so."""
+        self.requests += 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.flood_every and self.requests % self.flood_every == 0:
+            self.flood_waits += 1
+            raise FloodWaitError(None, capture=self.flood_seconds)
+
+    def _newest_date(self, chat_id):
+        """Return the date of a chat's newest message; chats are staggered one message interval apart."""
+        return self.now - (chat_id - FIRST_CHAT_ID) * self.message_interval
+
+    def _message_date(self, chat_id, message_id):
+        """Return the date of a message."""
+        return self._newest_date(chat_id) - (self.messages_per_chat - message_id) * self.message_interval
+
+    def _message_id_at(self, chat_id, date):
+        """Return the ID of the newest message sent at or before date (0 if none)."""
+        behind = (self._newest_date(chat_id) - date) / self.message_interval
+        if behind <= 0:
+            return self.messages_per_chat
+        return max(self.messages_per_chat - math.ceil(behind), 0)
+
+    def _message(self, chat_id, message_id):
+        """Build a message bound to this client; every media_every-th message is a photo without text."""
+        sender_id = ME_ID if message_id % 2 else chat_id
+        photo = self.media_every and message_id % self.media_every == 0
+        message = types.Message(
+            id=message_id,
+            peer_id=types.PeerUser(chat_id),
+            date=self._message_date(chat_id, message_id),
+            message="" if photo else f"Message {message_id} in chat {chat_id}",
+            out=sender_id == ME_ID,
+            from_id=types.PeerUser(sender_id),
+            media=types.MessageMediaPhoto(photo=types.PhotoEmpty(id=message_id)) if photo else None,
+        )
+        message._finish_init(self, self.users, None)
+        return message
+
+    def _dialog(self, chat_id):
+        """Build the dialog of a chat."""
+        dialog = types.Dialog(peer=types.PeerUser(chat_id), top_message=self.messages_per_chat,
+                              read_inbox_max_id=self.messages_per_chat, read_outbox_max_id=self.messages_per_chat,
+                              unread_count=0, unread_mentions_count=0, unread_reactions_count=0,
+                              notify_settings=types.PeerNotifySettings())
+        message = self._message(chat_id, self.messages_per_chat) if self.messages_per_chat else None
+        return Dialog(self, dialog, self.users, message)
+
+    async def iter_messages(self, entity, limit=None, offset_id=0, offset_date=None, reverse=False, min_id=0,
+                            max_id=0, wait_time=None):
+        """Yield a chat's messages with Telethon's offset and bound semantics, one simulated request per page."""
+        chat_id = utils.get_peer_id(entity) if not isinstance(entity, int) else entity
+        if chat_id not in self.users or chat_id == ME_ID:
+            return
+        low, high = 1, self.messages_per_chat  # Inclusive ID bounds
+        if min_id:
+            low = max(low, min_id + 1)
+        if max_id:
+            high = min(high, max_id - 1)
+        if reverse:
+            if offset_id:
+                low = max(low, offset_id + 1)
+            if offset_date:
+                low = max(low, self._message_id_at(chat_id, offset_date - timedelta(microseconds=1)) + 1)
+            message_ids = range(low, high + 1)
+        else:
+            if offset_id:
+                high = min(high, offset_id - 1)
+            if offset_date:
+                high = min(high, self._message_id_at(chat_id, offset_date - timedelta(microseconds=1)))
+            message_ids = range(high, low - 1, -1)
+        if limit is not None:
+            message_ids = message_ids[:limit]
+        for start in range(0, len(message_ids), self.page_size):
+            await self._request()
+            for message_id in message_ids[start:start + self.page_size]:
+                yield self._message(chat_id, message_id)
+
+    async def iter_dialogs(self, limit=None, offset_date=None, offset_id=0, offset_peer=None, ignore_pinned=False):
+        """Yield dialogs newest first, one simulated request per page."""
+        chat_ids = [FIRST_CHAT_ID + i for i in range(self.chats)]
+        if offset_date:
+            # Chats are staggered, so no two dialogs share a date
+            chat_ids = [chat_id for chat_id in chat_ids if self._newest_date(chat_id) < offset_date]
+        if limit is not None:
+            chat_ids = chat_ids[:limit]
+        for start in range(0, len(chat_ids), self.page_size):
+            await self._request()
+            for chat_id in chat_ids[start:start + self.page_size]:
+                yield self._dialog(chat_id)
+
+    async def get_entity(self, entity):
+        """Look up one or more users by ID."""
+        await self._request()
+        if isinstance(entity, list):
+            return [self.users[user_id] for user_id in entity if user_id in self.users]
+        if entity not in self.users:
+            raise ValueError(f"Could not find the entity {entity}")
+        return self.users[entity]
+
+    async def get_me(self, *args, **kwargs):
+        """Return the simulated logged-in user."""
+        return self.me
+
+    async def connect(self):
+        """Nothing to connect to."""
+
+    async def disconnect(self):
+        """Nothing to disconnect from."""
+
+    async def is_user_authorized(self):
+        """The simulated session is always authorized."""
+        return True
+
+    async def catch_up(self):
+        """No updates are simulated."""
+
+    def add_event_handler(self, callback, event=None):
+        """Live updates are not simulated."""
+
+    def remove_event_handler(self, callback, event=None):
+        """Live updates are not simulated."""
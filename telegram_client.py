@@ -1,15 +1,23 @@
 import asyncio
+import contextlib
 import os
 from datetime import datetime, timedelta
 import pytz
-from telethon import TelegramClient
-from telethon.errors import FloodWaitError
-from telethon.tl.types import User
-from utils import get_sender_name, get_message_content
-from database import save_messages, load_messages
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL, VERBOSE_LOGGING
+from telethon import TelegramClient, events
+from telethon.errors import FloodWaitError, TakeoutInitDelayError
+from telethon.tl.types import User, InputPeerEmpty
+from telethon.utils import get_peer_id
+from utils import get_sender_name, extract_message_content, MessageRow
+from database import (save_messages, load_messages, save_ingested_messages, load_backfill_state, save_backfill_state,
+                      load_coverage, add_coverage, count_messages, reconcile_messages, delete_messages_by_id,
+                      save_retention_policy, Session)
+from fetch_planner import HISTORY_START, extend_live_head, plan_window, plan_recent_messages
+from cache import SenderCache, DialogSnapshot
+from rate_limiter import RateLimiter
+from cassette import RecordingClient, ReplayClient
+from config import VERBOSE_LOGGING, SENDER_CACHE_SIZE, SENDER_CACHE_TTL, HISTORY_PAGE_SIZE, \
+    FETCH_CONCURRENCY, DIALOG_SNAPSHOT_TTL, INGEST_BATCH_SIZE, INGEST_FLUSH_SECONDS, BACKFILL_BATCH_SIZE, BACKFILL_WRITE_MODE, TELEGRAM_CASSETTE, TELEGRAM_CASSETTE_MODE, \
+    TELEGRAM_CASSETTE_LATENCY, RECONCILE_MESSAGES, RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST, RATE_LIMIT_MIN_PER_SECOND, RATE_LIMIT_RECOVERY_SECONDS
 from PyQt6.QtWidgets import QInputDialog
 import logging
 
@@ -21,18 +29,54 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SESSION_DIR = os.path.join(BASE_DIR, "sessions")
 os.makedirs(SESSION_DIR, exist_ok=True)
 
+# Messages or dialogs Telethon asks for in a single request
+REQUEST_CHUNK_SIZE = 100
+
 
 class TelegramManager:
     """Manages Telegram client operations such as connection, login, and message fetching."""
 
-    def __init__(self, user_phone, api_id, api_hash, parent=None):
-        """Initialize the Telegram client with a session name based on the user phone."""
-        session_name = user_phone.replace("+", "").replace(" ", "")
-        session_path = os.path.join(SESSION_DIR, f"session_{session_name}")
-        self.client = TelegramClient(session_path, api_id, api_hash)
+    def __init__(self, user_phone, api_id, api_hash, parent=None, client=None):
+        """Initialize the Telegram client with a session name based on the user phone.
+
+        An already constructed client (e.g. a fake one for tests and benchmarks) can be passed instead.
+        """
+        if client is None and TELEGRAM_CASSETTE_MODE == "replay":
+            client = ReplayClient.load(
+                TELEGRAM_CASSETTE, TELEGRAM_CASSETTE_LATENCY)
+            logger.info(f"Replaying Telegram responses from {TELEGRAM_CASSETTE}")
+        if client is None:
+            session_name = user_phone.replace("+", "").replace(" ", "")
+            session_path = os.path.join(SESSION_DIR, f"session_{session_name}")
+            client = TelegramClient(session_path, api_id, api_hash)
+            if TELEGRAM_CASSETTE_MODE == "record":
+                client = RecordingClient(client, TELEGRAM_CASSETTE)
+                logger.info(f"Recording Telegram responses to {TELEGRAM_CASSETTE}")
+        self.client = client
+        # Telethon's own flood-wait handling, kept for traffic that does not go through the rate limiter
+        self._flood_sleep_threshold = self.client.flood_sleep_threshold
+        self._limited_requests = 0  # Rate-limited requests in flight
+        self.user_phone = user_phone
         self.me = None  # To store current user info
         self.parent = parent  # Reference to parent widget for GUI dialogs
         self.updates_enabled = True  # Track update state
+        self._update_pauses = 0  # Number of running operations that paused updates
+        # Sender entities resolved during this session, keyed by sender ID
+        self.sender_cache = SenderCache(SENDER_CACHE_SIZE, SENDER_CACHE_TTL)
+        # Cache misses by how they were resolved: attached to a history page, bulk get_entity or get_sender()
+        self.sender_resolutions = {"page": 0, "bulk": 0, "single": 0}
+        # Private chats from the last dialog scan, shared by the chat list, refresh and search
+        self.dialog_snapshot = DialogSnapshot(DIALOG_SNAPSHOT_TTL)
+        # Request budget shared by every call this manager makes
+        self.rate_limiter = RateLimiter(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST,
+                                        RATE_LIMIT_MIN_PER_SECOND, RATE_LIMIT_RECOVERY_SECONDS)
+        # Real-time ingestion of new and edited messages
+        self.ingesting_since = None  # When the update handlers were registered, None while stopped
+        self._ingest_buffer = []  # Pending ("new" | "edit", message) events
+        self._ingest_ready = asyncio.Event()
+        self._ingest_lock = asyncio.Lock()
+        self._ingest_task = None
+        self._stale_chats = set()  # Chats with unsaved ingested events, not kept current until fetched again
 
     async def connect(self):
         """Establish a connection to Telegram servers."""
@@ -64,46 +108,105 @@ class TelegramManager:
             raise
 
     async def toggle_updates(self, enable=True):
-        """Enable or disable background updates."""
-        if enable and not self.updates_enabled:
-            self.updates_enabled = True
-            logger.info("Background updates enabled.")
-        elif not enable and self.updates_enabled:
-            self.updates_enabled = False
-            logger.info("Background updates disabled.")
+        """Enable or disable background updates.
+
+        Disabling is counted, so with concurrent fetches updates resume only after the last one re-enables them.
+        """
+        if enable:
+            self._update_pauses = max(self._update_pauses - 1, 0)
+            if self._update_pauses == 0 and not self.updates_enabled:
+                self.updates_enabled = True
+                logger.info("Background updates enabled.")
+        else:
+            self._update_pauses += 1
+            if self.updates_enabled:
+                self.updates_enabled = False
+                logger.info("Background updates disabled.")
+
+    def _chat_from_dialog(self, dialog):
+        """Return (chat_id, name, username) for a private chat with a non-bot user, or None for other dialogs."""
+        if not (dialog.is_user and isinstance(dialog.entity, User) and not dialog.entity.bot):
+            return None
+        # Extract chat name, prioritizing first_name and last_name
+        chat_name = dialog.name.strip() if dialog.name else ""
+        if not chat_name:  # If dialog.name is empty, construct name from first_name/last_name
+            first_name = dialog.entity.first_name or ""
+            last_name = dialog.entity.last_name or ""
+            chat_name = f"{first_name} {last_name}".strip()
+            if not chat_name:  # If still empty, use a default
+                chat_name = f"Unknown User (ID: {dialog.id})"
+        # Ensure username is a string (handle None case)
+        username = dialog.entity.username if dialog.entity.username else ""
+        return dialog.id, chat_name, username
+
+    async def _scan_dialogs_since(self, since=None):
+        """Read dialogs newest-first until the first non-pinned dialog whose last activity is not after since.
+
+        Pinned dialogs are listed first regardless of their date, so they never end the scan. Returns the
+        private chats seen as (chat, dialog_date) entries, the newest non-pinned dialog date and the number
+        of dialogs read. Without since, every dialog is read.
+        """
+        entries = []
+        latest_date = None
+        scanned = 0
+        async for dialog in self.safe_iter_dialogs():
+            dialog_date = dialog.date
+            if dialog_date is not None and dialog_date.tzinfo is None:
+                dialog_date = dialog_date.replace(tzinfo=pytz.UTC)
+            if not dialog.pinned and dialog_date is not None:
+                if since is not None and dialog_date <= since:
+                    # Leaving the loop here means no further page is requested
+                    break
+                if latest_date is None or dialog_date > latest_date:
+                    latest_date = dialog_date
+            scanned += 1
+            if VERBOSE_LOGGING:
+                logger.debug(
+                    f"Processing dialog: {dialog.name}, is_user={dialog.is_user}, entity_type={type(dialog.entity)}")
+            # Prewarm the sender cache with the entities Telegram already sent us
+            self.sender_cache.put(dialog.id, dialog.entity)
+            chat = self._chat_from_dialog(dialog)
+            if chat:
+                entries.append((chat, dialog_date))
+                if VERBOSE_LOGGING:
+                    logger.debug(
+                        f"Added chat: {chat[1]} (ID: {chat[0]}, Username: {chat[2]})")
+        return entries, latest_date, scanned
+
+    async def refresh_dialogs(self, full=False):
+        """Refresh the dialog snapshot from Telegram.
+
+        A full refresh scans every dialog. Otherwise only dialogs with activity newer than the snapshot
+        are read.
+        """
+        full = full or not self.dialog_snapshot.loaded
+        since = None if full else self.dialog_snapshot.latest_date
+        entries, latest_date, scanned = await self._scan_dialogs_since(since)
+        if full:
+            self.dialog_snapshot.replace(entries, latest_date)
+            logger.info(
+                f"Dialog snapshot loaded with {len(entries)} private chats from {scanned} dialogs")
+        else:
+            self.dialog_snapshot.merge(entries, latest_date)
+            logger.info(
+                f"Dialog snapshot refreshed: {len(entries)} updated private chats from {scanned} dialogs")
+
+    async def _ensure_dialogs(self):
+        """Refresh the dialog snapshot incrementally if it is missing or older than its TTL."""
+        if not self.dialog_snapshot.is_fresh():
+            await self.refresh_dialogs()
 
     async def fetch_chats(self):
         """Retrieve private chats from Telegram with adaptive rate limiting."""
         logger.info("Loading chat list")
-        chats = []
         try:
             await self.toggle_updates(False)
-            async for dialog in self.client.iter_dialogs():
-                if VERBOSE_LOGGING:
-                    logger.debug(
-                        f"Processing dialog: {dialog.name}, is_user={dialog.is_user}, entity_type={type(dialog.entity)}")
-                if dialog.is_user and isinstance(dialog.entity, User) and not dialog.entity.bot:
-                    # Extract chat name, prioritizing first_name and last_name
-                    chat_name = dialog.name.strip() if dialog.name else ""
-                    if not chat_name:  # If dialog.name is empty, construct name from first_name/last_name
-                        first_name = dialog.entity.first_name or ""
-                        last_name = dialog.entity.last_name or ""
-                        chat_name = f"{first_name} {last_name}".strip()
-                        if not chat_name:  # If still empty, use a default
-                            chat_name = f"Unknown User (ID: {dialog.id})"
-                    # Ensure username is a string (handle None case)
-                    username = dialog.entity.username if dialog.entity.username else ""
-                    chats.append((dialog.id, chat_name, username))
-                    if VERBOSE_LOGGING:
-                        logger.debug(
-                            f"Added chat: {chat_name} (ID: {dialog.id}, Username: {username})")
+            await self.refresh_dialogs(full=True)
+            chats = self.dialog_snapshot.chats()
             logger.info(f"Retrieved {len(chats)} private chats from Telegram")
+            logger.debug(
+                f"Sender cache prewarmed with {len(self.sender_cache)} entities")
             return chats
-        except FloodWaitError as e:
-            wait_time = e.seconds
-            logger.warning(f"FloodWaitError: Waiting for {wait_time} seconds.")
-            await asyncio.sleep(wait_time)
-            return await self.fetch_chats()
         except Exception as e:
             logger.error(f"Error loading chats: {e}")
             return []
@@ -113,48 +216,17 @@ class TelegramManager:
     async def search_chat_by_id_or_name(self, search_term):
         """Search for chats by ID, name, or username (case-insensitive). Returns a list of matching (chat_id, name, username)."""
         logger.info(f"Searching for chat with term: {search_term}")
-        chats = []
         try:
             await self.toggle_updates(False)
-            async for dialog in self.client.iter_dialogs():
-                if dialog.is_user and isinstance(dialog.entity, User) and not dialog.entity.bot:
-                    # Extract chat name, prioritizing first_name and last_name
-                    chat_name = dialog.name.strip() if dialog.name else ""
-                    if not chat_name:
-                        first_name = dialog.entity.first_name or ""
-                        last_name = dialog.entity.last_name or ""
-                        chat_name = f"{first_name} {last_name}".strip()
-                        if not chat_name:
-                            chat_name = f"Unknown User (ID: {dialog.id})"
-                    # Ensure username is a string
-                    username = dialog.entity.username if dialog.entity.username else ""
-                    chat_id = str(dialog.id)
-                    chat_name_lower = chat_name.lower()
-                    username_lower = username.lower() if username else ""
-                    search_term_lower = search_term.lower()
-
-                    if search_term_lower.startswith('@'):
-                        search_term_clean = search_term_lower[1:]
-                        if search_term_clean and search_term_clean == username_lower:
-                            chats.append((dialog.id, chat_name, username))
-                            if VERBOSE_LOGGING:
-                                logger.debug(
-                                    f"Found matching chat by username: {chat_name} (ID: {dialog.id}, Username: {username})")
-                    else:
-                        if search_term_lower == chat_id or search_term_lower in chat_name_lower:
-                            chats.append((dialog.id, chat_name, username))
-                            if VERBOSE_LOGGING:
-                                logger.debug(
-                                    f"Found matching chat by ID or name: {chat_name} (ID: {dialog.id})")
-
+            await self._ensure_dialogs()
+            chats = self.dialog_snapshot.search(search_term)
+            if VERBOSE_LOGGING:
+                for chat_id, chat_name, username in chats:
+                    logger.debug(
+                        f"Found matching chat: {chat_name} (ID: {chat_id}, Username: {username})")
             logger.info(
                 f"Found {len(chats)} chats matching search term: {search_term}")
             return chats
-        except FloodWaitError as e:
-            wait_time = e.seconds
-            logger.warning(f"FloodWaitError: Waiting for {wait_time} seconds.")
-            await asyncio.sleep(wait_time)
-            return await self.search_chat_by_id_or_name(search_term)
         except Exception as e:
             logger.error(f"Error searching chats: {e}")
             return []
@@ -164,53 +236,128 @@ class TelegramManager:
     async def fetch_new_chats(self, last_update_timestamp=None):
         """Retrieve only new or updated private chats since the last update."""
         logger.info("Checking for new or updated chats")
-        new_chats = []
         try:
             await self.toggle_updates(False)
-            async for dialog in self.client.iter_dialogs():
-                if dialog.is_user and isinstance(dialog.entity, User) and not dialog.entity.bot:
-                    dialog_date = dialog.date
-                    if dialog_date.tzinfo is None:
-                        dialog_date = dialog_date.replace(tzinfo=pytz.UTC)
-                    if last_update_timestamp and last_update_timestamp.tzinfo is None:
-                        last_update_timestamp = last_update_timestamp.replace(
-                            tzinfo=pytz.UTC)
-                    if last_update_timestamp is None or dialog_date > last_update_timestamp:
-                        # Extract chat name, prioritizing first_name and last_name
-                        chat_name = dialog.name.strip() if dialog.name else ""
-                        if not chat_name:  # If dialog.name is empty, construct name from first_name/last_name
-                            first_name = dialog.entity.first_name or ""
-                            last_name = dialog.entity.last_name or ""
-                            chat_name = f"{first_name} {last_name}".strip()
-                            if not chat_name:  # If still empty, use a default
-                                chat_name = f"Unknown User (ID: {dialog.id})"
-                        # Ensure username is a string (handle None case)
-                        username = dialog.entity.username if dialog.entity.username else ""
-                        new_chats.append((dialog.id, chat_name, username))
-                        if VERBOSE_LOGGING:
-                            logger.debug(
-                                f"Added new chat: {chat_name} (ID: {dialog.id}, Username: {username})")
+            if last_update_timestamp and last_update_timestamp.tzinfo is None:
+                last_update_timestamp = last_update_timestamp.replace(
+                    tzinfo=pytz.UTC)
+            if self.dialog_snapshot.loaded or last_update_timestamp is None:
+                await self._ensure_dialogs()
+                new_chats = self.dialog_snapshot.chats_since(
+                    last_update_timestamp)
+            else:
+                # Without a snapshot, read only the dialogs active since the last update
+                entries, _, scanned = await self._scan_dialogs_since(last_update_timestamp)
+                new_chats = [chat for chat, dialog_date in entries
+                             if dialog_date is not None and dialog_date > last_update_timestamp]
+                logger.info(
+                    f"Scanned {scanned} dialogs active since {last_update_timestamp}")
             if new_chats:
                 logger.info(f"Found {len(new_chats)} new or updated chats")
             else:
                 logger.info("No new or updated chats found")
             return new_chats
-        except FloodWaitError as e:
-            wait_time = e.seconds
-            logger.warning(f"FloodWaitError: Waiting for {wait_time} seconds.")
-            await asyncio.sleep(wait_time)
-            return await self.fetch_new_chats(last_update_timestamp)
         except Exception as e:
             logger.error(f"Error checking new chats: {e}")
             return []
         finally:
             await self.toggle_updates(True)
 
-    async def safe_iter_messages(self, chat_id, limit=None, offset_id=0, offset_date=None, reverse=False):
-        """Safely iterate over messages with adaptive rate limiting."""
+    async def _wait_for_flood(self, error):
+        """Sleep for the duration requested by a FloodWaitError, slowing down every other request as well."""
+        wait_time = error.seconds
+        logger.warning(f"Rate limit hit, waiting {wait_time} seconds")
+        await self.rate_limiter.wait_for_flood(wait_time)
+
+    @contextlib.contextmanager
+    def _raise_flood_waits(self):
+        """Make Telethon raise flood waits instead of sleeping on them while a rate-limited request is in flight.
+
+        The threshold is client-wide, so it is lowered only for the duration of such requests; updates, login
+        and other traffic keep Telethon's handling.
+        """
+        if self._limited_requests == 0:
+            self.client.flood_sleep_threshold = 0
+        self._limited_requests += 1
+        try:
+            yield
+        finally:
+            self._limited_requests -= 1
+            if self._limited_requests == 0:
+                self.client.flood_sleep_threshold = self._flood_sleep_threshold
+
+    async def _limited_iter(self, iterable):
+        """Iterate over a Telethon request iterator, raising its flood waits only while a page is requested."""
+        iterator = iterable.__aiter__()
+        while True:
+            with self._raise_flood_waits():
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield item
+
+    def rate_limiter_stats(self):
+        """Return the current request rate and wait totals of the shared rate limiter."""
+        return self.rate_limiter.stats()
+
+    async def safe_iter_dialogs(self):
+        """Safely iterate over dialogs, resuming after the last yielded dialog when a flood wait interrupts."""
+        seen = set()
+        offset_date = None
+        offset_id = 0
+        offset_peer = InputPeerEmpty()
         while True:
             try:
-                async for msg in self.client.iter_messages(chat_id, limit=limit, offset_id=offset_id, offset_date=offset_date, reverse=reverse):
+                await self.rate_limiter.acquire()
+                received = 0
+                # Pinned dialogs all arrive in the first page, so they are only requested again on a fresh start
+                async for dialog in self._limited_iter(self.client.iter_dialogs(
+                        offset_date=offset_date, offset_id=offset_id, offset_peer=offset_peer,
+                        ignore_pinned=bool(seen))):
+                    received += 1
+                    if received % REQUEST_CHUNK_SIZE == 0:
+                        # The next dialog triggers another request
+                        await self.rate_limiter.acquire()
+                    if dialog.id in seen:
+                        continue
+                    seen.add(dialog.id)
+                    if dialog.message is not None and not dialog.pinned:
+                        offset_date = dialog.message.date
+                        offset_id = dialog.message.id
+                        offset_peer = dialog.input_entity
+                    yield dialog
+                break
+            except FloodWaitError as e:
+                await self._wait_for_flood(e)
+                if seen:
+                    logger.info(
+                        f"Resuming dialog iteration after {len(seen)} dialogs")
+
+    async def safe_iter_messages(self, chat_id, limit=None, offset_id=0, offset_date=None, reverse=False, min_id=0, wait_time=None,
+                                 client=None):
+        """Safely iterate over messages, resuming after the last yielded message when a flood wait interrupts.
+
+        client defaults to this manager's client; a takeout session can be passed instead.
+        """
+        client = client or self.client
+        yielded = 0
+        while True:
+            remaining = None if limit is None else limit - yielded
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                await self.rate_limiter.acquire()
+                async for msg in self._limited_iter(client.iter_messages(
+                        chat_id, limit=remaining, offset_id=offset_id, offset_date=offset_date, reverse=reverse,
+                        min_id=min_id, wait_time=wait_time)):
+                    # Checkpoint before yielding so a resumed iterator starts right after this message
+                    offset_id = msg.id
+                    offset_date = None
+                    yielded += 1
+                    if yielded % REQUEST_CHUNK_SIZE == 0:
+                        # The next message triggers another request
+                        await self.rate_limiter.acquire()
                     if msg.date:
                         if msg.date.tzinfo is None:
                             logger.debug(
@@ -223,140 +370,543 @@ class TelegramManager:
                         continue
                 break
             except FloodWaitError as e:
-                wait_time = e.seconds
-                logger.warning(f"Rate limit hit, waiting {wait_time} seconds")
-                await asyncio.sleep(wait_time)
+                await self._wait_for_flood(e)
+                if yielded:
+                    logger.info(
+                        f"Resuming chat {chat_id} history after message ID {offset_id}")
             except Exception as e:
-                logger.error(f"Error in яsafe_iter_messages: {e}")
+                logger.error(f"Error in safe_iter_messages: {e}")
                 raise
 
+    async def iter_history_pages(self, chat_id, limit=None, offset_id=0, offset_date=None, min_id=0, min_date=None,
+                                 page_size=HISTORY_PAGE_SIZE):
+        """Stream a chat's history newest-first over a single iterator, yielding lists of up to page_size messages.
+
+        Iteration stops at the first message older than min_date, so callers get exactly the requested range.
+        """
+        page = []
+        # One open iterator requests full pages back to back; pacing is left to the shared rate limiter
+        async for message in self.safe_iter_messages(chat_id, limit=limit, offset_id=offset_id, offset_date=offset_date,
+                                                     min_id=min_id, wait_time=0):
+            if min_date and message.date < min_date:
+                break
+            page.append(message)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    async def resolve_sender_name(self, message):
+        """Resolve the display name of a message sender, using the sender cache when possible."""
+        sender_id = message.sender_id
+        sender = self.sender_cache.get(
+            sender_id) if sender_id is not None else None
+        if sender is None:
+            while True:
+                await self.rate_limiter.acquire()
+                try:
+                    with self._raise_flood_waits():
+                        sender = await message.get_sender()
+                    break
+                except FloodWaitError as e:
+                    await self._wait_for_flood(e)
+            self.sender_cache.put(sender_id, sender)
+            self.sender_resolutions["single"] += 1
+        return get_sender_name(sender, self.me)
+
+    async def resolve_senders(self, messages):
+        """Resolve the distinct senders of a page of messages with at most one bulk entity request.
+
+        Each sender resolved here counts as one cache miss; senders left unresolved are counted by
+        resolve_sender_name.
+        """
+        unknown_ids = set()
+        for message in messages:
+            sender_id = message.sender_id
+            if sender_id is None or sender_id in self.sender_cache or sender_id in unknown_ids:
+                continue
+            # Telethon attaches senders from the entities returned alongside the history page
+            if message.sender is not None:
+                self.sender_cache.put(sender_id, message.sender)
+                self.sender_cache.record_miss()
+                self.sender_resolutions["page"] += 1
+            else:
+                unknown_ids.add(sender_id)
+
+        if not unknown_ids:
+            return
+        try:
+            while True:
+                await self.rate_limiter.acquire()
+                try:
+                    with self._raise_flood_waits():
+                        entities = await self.client.get_entity(list(unknown_ids))
+                    break
+                except FloodWaitError as e:
+                    await self._wait_for_flood(e)
+            for entity in entities:
+                self.sender_cache.put(get_peer_id(entity), entity)
+                self.sender_cache.record_miss()
+                self.sender_resolutions["bulk"] += 1
+            if VERBOSE_LOGGING:
+                logger.debug(
+                    f"Resolved {len(entities)} senders in one bulk request")
+        except Exception as e:
+            # Senders left unresolved here fall back to get_sender() one by one
+            logger.warning(f"Bulk sender resolution failed: {e}")
+
+    async def build_message_rows(self, messages):
+        """Convert a page of messages into (sender, text, timestamp, message_id) rows carrying media metadata."""
+        await self.resolve_senders(messages)
+        rows = []
+        for message in messages:
+            sender_name = await self.resolve_sender_name(message)
+            message_content, media_type, media_meta = extract_message_content(
+                message)
+            rows.append(MessageRow(sender_name, message_content, message.date, message.id,
+                                   media_type, media_meta, message.edit_date))
+        return rows
+
+    def sender_cache_stats(self):
+        """Return hit/miss counters of the sender cache for this session and how its misses were resolved."""
+        return {**self.sender_cache.stats(), "resolved": dict(self.sender_resolutions)}
+
     async def get_messages(self, chat_id, filter_type, filter_value, user_timezone, user_phone, progress_callback=None):
         """Fetch messages from a chat based on the specified filter and user timezone."""
-        db_messages, full_day_covered, latest_timestamp = load_messages(
-            chat_id, filter_type, filter_value, user_phone, user_timezone)
         messages = []
+        try:
+            async with contextlib.aclosing(self.stream_messages(chat_id, filter_type, filter_value, user_timezone,
+                                                                user_phone, progress_callback)) as batches:
+                async for batch in batches:
+                    messages.extend(batch)
+            return messages
+        except Exception as e:
+            logger.error(f"Error fetching messages from Telegram: {e}")
+            return []
+
+    async def stream_messages(self, chat_id, filter_type, filter_value, user_timezone, user_phone, progress_callback=None):
+        """Yield the messages matching a filter in batches, newest first, as Telegram returns them.
+
+        Only the ranges missing from the chat's coverage index are fetched. Batches hold the same deduplicated,
+        ordered rows get_messages returns, merged with the stored ones, and each fetched page is saved before
+        its batch is yielded. Close the generator (e.g. with contextlib.aclosing) when stopping early so live
+        updates are resumed.
+        """
+        if self.ingesting_since is not None:
+            await self.flush_ingestion()
+        db_messages, _, _ = load_messages(
+            chat_id, filter_type, filter_value, user_phone, user_timezone)
+        coverage = load_coverage(chat_id, user_phone)
+        now = datetime.now(pytz.UTC)
+        live_since = self.ingesting_since if chat_id not in self._stale_chats else None
+        live_head = extend_live_head(coverage, live_since, now)
+        if live_head is not None:
+            logger.info(
+                "Serving chat from the database, kept current by live updates")
+            add_coverage(chat_id, user_phone, *live_head)
+
+        if filter_type == "recent_messages":
+            gaps = plan_recent_messages(coverage, filter_value, now,
+                                        lambda covered_from, covered_to: count_messages(
+                                            chat_id, user_phone, covered_from, covered_to))
+
+            def in_window(msg):
+                return True
+
+            def progress_for(total_fetched):
+                return min((total_fetched / filter_value) * 90, 90)  # Limit to 90%
+
+        elif filter_type == "specific_date":
+            specific_date = datetime.strptime(filter_value, '%d %B %Y')
+            local_start = user_timezone.localize(
+                specific_date.replace(hour=0, minute=0, second=0))
+            local_end = local_start.replace(hour=23, minute=59, second=59)
+            min_date = local_start.astimezone(pytz.UTC)
+            max_date = local_end.astimezone(pytz.UTC)
+            gaps = plan_window(coverage, min_date, max_date, now)
+
+            def in_window(msg):
+                return min_date <= msg[2] <= max_date
+
+            def progress_for(total_fetched):
+                return min(total_fetched * 1.8, 90)  # Limit to 90%
+
+        elif filter_type == "recent_days":
+            min_date = datetime.now(user_timezone) - \
+                timedelta(days=filter_value)
+            min_date = min_date.astimezone(pytz.UTC)
+            gaps = plan_window(coverage, min_date, now, now)
+
+            def in_window(msg):
+                return msg[2] >= min_date
+
+            def progress_for(total_fetched):
+                return min(total_fetched * 1.8, 90)  # Limit to 90%
+
+        else:
+            logger.error(f"Unknown filter type: {filter_type}")
+            return
+
+        limit = filter_value if filter_type == "recent_messages" else None
         total_fetched = 0
+        emitted = 0
+        saved = True
+        seen = set()
+        db_index = 0  # db_messages is newest first; rows before db_index have been merged
 
         try:
             await self.toggle_updates(False)
-            batch_size = 50
-
-            if filter_type == "recent_messages":
-                messages_to_fetch = filter_value
-                offset_id = 0
+            # Gaps are planned newest first, so pages keep arriving in descending order across gaps
+            for gap in gaps:
+                logger.info(
+                    f"Fetching chat ID {chat_id} from {gap.covered_to} back to {gap.covered_from}")
+                async for page in self.iter_history_pages(chat_id, limit=gap.limit, offset_id=gap.offset_id,
+                                                          offset_date=gap.offset_date, min_id=gap.min_id,
+                                                          min_date=gap.min_date):
+                    rows = await self.build_message_rows(page)
+                    if not rows:
+                        continue
+                    gap.record(rows)
+                    total_fetched += len(rows)
+                    if progress_callback:
+                        await progress_callback(progress_for(total_fetched))
+                    if not self._store_batch(chat_id, user_phone, rows):
+                        saved = False
 
-                while total_fetched < messages_to_fetch:
-                    batch = []
-                    limit = min(batch_size, messages_to_fetch - total_fetched)
-                    async for message in self.safe_iter_messages(chat_id, limit=limit, offset_id=offset_id):
-                        sender = await message.get_sender()
-                        sender_name = get_sender_name(sender, self.me)
-                        message_content = get_message_content(message)
-                        message_date = message.date
-                        batch.append(
-                            (sender_name, message_content, message_date, message.id))
-                    if not batch:
-                        break
-                    messages.extend(batch)
-                    total_fetched += len(batch)
+                    # Every later page is older than this one, so stored messages newer than its oldest are final
+                    page_oldest = min(msg[2] for msg in rows)
+                    merged = {msg[3]: msg for msg in rows}
+                    while db_index < len(db_messages) and db_messages[db_index][2] > page_oldest:
+                        merged.setdefault(db_messages[db_index][3], db_messages[db_index])
+                        db_index += 1
+                    batch = self._take_batch(merged.values(), seen, in_window, limit, emitted)
                     if batch:
-                        offset_id = batch[-1][3]
-                    if progress_callback:
-                        progress = (total_fetched /
-                                    messages_to_fetch) * 90  # Limit to 90%
-                        progress = min(progress, 90)
-                        await progress_callback(progress)
-
-            elif filter_type == "specific_date":
-                specific_date = datetime.strptime(filter_value, '%d %B %Y')
-                local_start = user_timezone.localize(
-                    specific_date.replace(hour=0, minute=0, second=0))
-                local_end = local_start.replace(hour=23, minute=59, second=59)
-                min_date = local_start.astimezone(pytz.UTC)
-                max_date = local_end.astimezone(pytz.UTC)
-
-                if full_day_covered:
-                    return db_messages
-
-                offset_id = 0
-                while True:
-                    batch = []
-                    async for message in self.safe_iter_messages(chat_id, limit=batch_size, offset_id=offset_id):
-                        message_date = message.date
-                        if message_date < min_date:
-                            break
-                        if min_date <= message_date <= max_date:
-                            sender = await message.get_sender()
-                            sender_name = get_sender_name(sender, self.me)
-                            message_content = get_message_content(message)
-                            batch.append(
-                                (sender_name, message_content, message_date, message.id))
-                        offset_id = message.id
-                    if not batch:
-                        break
-                    messages.extend(batch)
-                    total_fetched += len(batch)
-                    if progress_callback:
-                        progress = min(total_fetched * 1.8, 90)  # Limit to 90%
-                        await progress_callback(progress)
-
-            elif filter_type == "recent_days":
-                min_date = datetime.now(user_timezone) - \
-                    timedelta(days=filter_value)
-                min_date = min_date.astimezone(pytz.UTC)
-                offset_id = 0
-                while True:
-                    batch = []
-                    async for message in self.safe_iter_messages(chat_id, limit=batch_size, offset_id=offset_id):
-                        message_date = message.date
-                        if message_date < min_date:
-                            break
-                        sender = await message.get_sender()
-                        sender_name = get_sender_name(sender, self.me)
-                        message_content = get_message_content(message)
-                        batch.append(
-                            (sender_name, message_content, message_date, message.id))
-                        offset_id = message.id
-                    if not batch:
-                        break
-                    messages.extend(batch)
-                    total_fetched += len(batch)
-                    if progress_callback:
-                        progress = min(total_fetched * 1.8, 90)  # Limit to 90%
-                        await progress_callback(progress)
-
-            combined_messages = db_messages + messages
-            combined_messages = list(
-                {msg[3]: msg for msg in combined_messages}.values())
-            combined_messages.sort(key=lambda x: x[2], reverse=True)
-
-            if filter_type == "recent_messages":
-                messages = combined_messages[:filter_value]
-            elif filter_type == "recent_days":
-                messages = [
-                    msg for msg in combined_messages if msg[2] >= min_date]
-            else:
-                messages = [
-                    msg for msg in combined_messages if min_date <= msg[2] <= max_date]
+                        emitted += len(batch)
+                        yield batch
+                if saved:
+                    add_coverage(chat_id, user_phone, *gap.coverage())
+                    if gap.covered_to >= now and chat_id in self._stale_chats:
+                        await self._drop_stale_events(chat_id, now)
+
+            if total_fetched == 0:
+                logger.info(
+                    f"Chat ID {chat_id} served from the database without fetching")
+            batch = self._take_batch(db_messages[db_index:], seen, in_window, limit, emitted)
+            if batch:
+                emitted += len(batch)
+                yield batch
+        finally:
+            await self.toggle_updates(True)
+
+    def _take_batch(self, messages, seen, in_window, limit, emitted):
+        """Return unseen in-window messages newest first, capped so no more than limit are emitted in total."""
+        batch = [msg for msg in messages if msg[3] not in seen and in_window(msg)]
+        batch.sort(key=lambda x: x[2], reverse=True)
+        if limit is not None:
+            batch = batch[:max(limit - emitted, 0)]
+        seen.update(msg[3] for msg in batch)
+        return batch
 
-            if messages:
-                engine = create_engine(DATABASE_URL)
-                Session = sessionmaker(bind=engine)
+    def _store_batch(self, chat_id, user_phone, messages):
+        """Save a batch of fetched messages, returning whether it was stored."""
+        db_session = Session()
+        try:
+            save_messages(db_session, chat_id, user_phone, messages)
+            db_session.commit()
+            return True
+        except Exception as e:
+            db_session.rollback()
+            logger.error(f"Error saving messages to database: {e}")
+            return False
+        finally:
+            db_session.close()
+
+    async def reconcile_chat(self, chat_id, user_phone, limit=RECONCILE_MESSAGES):
+        """Re-read a chat's newest limit messages and update the stored ones that were edited or deleted since.
+
+        Only changed rows are written. Returns (updated_count, deleted_count).
+        """
+        updated_count = deleted_count = 0
+        try:
+            await self.toggle_updates(False)
+            newer_than = None  # Lowest message ID of the previous page; the next page covers the IDs below it
+            async for page in self.iter_history_pages(chat_id, limit=limit):
+                rows = await self.build_message_rows(page)
+                high = newer_than - 1 if newer_than is not None else None
+                # A page returns every message between its oldest and the previous page, so gaps are deletions
                 db_session = Session()
                 try:
-                    save_messages(db_session, chat_id, user_phone, messages)
+                    updated, deleted = reconcile_messages(
+                        db_session, chat_id, user_phone, rows, deleted_range=(page[-1].id, high))
                     db_session.commit()
-                except Exception as e:
+                except Exception:
                     db_session.rollback()
-                    logger.error(f"Error saving messages to database: {e}")
+                    raise
                 finally:
                     db_session.close()
+                updated_count += updated
+                deleted_count += deleted
+                newer_than = page[-1].id
+            logger.info(
+                f"Reconciled chat {chat_id}: {updated_count} edited, {deleted_count} deleted")
+        except Exception as e:
+            logger.error(f"Error reconciling chat {chat_id}: {e}")
+        finally:
+            await self.toggle_updates(True)
+        return updated_count, deleted_count
 
-            return messages
+    async def start_ingestion(self):
+        """Store new and edited private messages as they arrive, then catch up on updates missed while offline.
 
+        Deleted messages are removed from the database as their deletion updates arrive.
+        """
+        if self.ingesting_since is not None:
+            return
+        self.client.add_event_handler(
+            self._on_new_message, events.NewMessage(func=lambda e: e.is_private))
+        self.client.add_event_handler(
+            self._on_message_edited, events.MessageEdited(func=lambda e: e.is_private))
+        # Deletions in private chats arrive without a chat, so they cannot be filtered by chat type
+        self.client.add_event_handler(
+            self._on_message_deleted, events.MessageDeleted())
+        self.ingesting_since = datetime.now(pytz.UTC)
+        self._ingest_task = asyncio.ensure_future(self._ingest_worker())
+        logger.info("Real-time message ingestion started")
+        try:
+            await self.client.catch_up()
+        except FloodWaitError as e:
+            await self._wait_for_flood(e)
         except Exception as e:
-            logger.error(f"Error fetching messages from Telegram: {e}")
-            return []
+            logger.error(f"Error catching up on missed updates: {e}")
+
+    async def stop_ingestion(self):
+        """Unregister the update handlers and write any buffered messages."""
+        if self.ingesting_since is None:
+            return
+        self.client.remove_event_handler(self._on_new_message)
+        self.client.remove_event_handler(self._on_message_edited)
+        self.client.remove_event_handler(self._on_message_deleted)
+        self.ingesting_since = None
+        if self._ingest_task:
+            self._ingest_task.cancel()
+            self._ingest_task = None
+        await self.flush_ingestion()
+        logger.info("Real-time message ingestion stopped")
+
+    async def _on_new_message(self, event):
+        """Buffer a new private message for ingestion."""
+        self._buffer_event("new", event.message)
+
+    async def _on_message_edited(self, event):
+        """Buffer an edited private message for ingestion."""
+        self._buffer_event("edit", event.message)
+
+    async def _on_message_deleted(self, event):
+        """Buffer deleted message IDs for ingestion."""
+        self._ingest_buffer.append(("delete", event))
+        if len(self._ingest_buffer) >= INGEST_BATCH_SIZE:
+            self._ingest_ready.set()
+
+    def _buffer_event(self, kind, message):
+        """Queue a message event and wake the ingestion worker once a full batch is waiting."""
+        if message.date is None:
+            return
+        if message.date.tzinfo is None:
+            message.date = message.date.replace(tzinfo=pytz.UTC)
+        self._ingest_buffer.append((kind, message))
+        if len(self._ingest_buffer) >= INGEST_BATCH_SIZE:
+            self._ingest_ready.set()
+
+    async def _ingest_worker(self):
+        """Write buffered messages in batches, holding them back while a fetch has paused updates."""
+        while True:
+            try:
+                await asyncio.wait_for(self._ingest_ready.wait(), INGEST_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._ingest_ready.clear()
+            if self.updates_enabled:
+                try:
+                    await self.flush_ingestion()
+                except Exception as e:
+                    logger.error(f"Error ingesting messages: {e}")
+
+    async def flush_ingestion(self):
+        """Write every buffered message event to the database, grouped by chat.
+
+        Events of a chat that could not be converted or saved stay buffered for the next flush, and the chat is
+        no longer treated as kept current by live updates until a fetch has caught it up to now.
+        """
+        async with self._ingest_lock:
+            if not self._ingest_buffer:
+                return
+            items, self._ingest_buffer = self._ingest_buffer, []
+            by_chat = {}
+            deletions = []
+            for kind, message in items:
+                if kind == "delete":
+                    deletions.append(message)
+                    continue
+                by_chat.setdefault(message.chat_id, []).append((kind, message))
+            deleted_ids = {message_id for event in deletions for message_id in event.deleted_ids}
+            failed = []
+            for chat_id, events in by_chat.items():
+                new = [message for kind, message in events if kind == "new"]
+                edited = [message for kind, message in events if kind == "edit"]
+                try:
+                    new_rows = await self.build_message_rows(new)
+                    edited_rows = await self.build_message_rows(edited)
+                    live_since = self.ingesting_since if chat_id not in self._stale_chats else None
+                    save_ingested_messages(
+                        chat_id, self.user_phone, new_rows, edited_rows, live_since)
+                except Exception as e:
+                    logger.error(
+                        f"Error ingesting {len(events)} message events for chat ID {chat_id}, keeping them: {e}")
+                    self._stale_chats.add(chat_id)
+                    # Messages deleted in this batch must not come back when the events are retried
+                    failed.extend((kind, message)
+                                  for kind, message in events if message.id not in deleted_ids)
+            # Deletions go last so a message created and deleted within one batch does not stay stored
+            for event in deletions:
+                delete_messages_by_id(
+                    self.user_phone, event.deleted_ids, event.chat_id)
+            self._ingest_buffer[:0] = failed
+            if VERBOSE_LOGGING:
+                logger.debug(
+                    f"Ingested {len(items) - len(failed)} message events from {len(by_chat)} chats")
+
+    async def _drop_stale_events(self, chat_id, fetched_until):
+        """Forget a chat's unsaved events once a fetch has stored its history up to fetched_until.
+
+        Edits to older messages are picked up again by reconcile_chat.
+        """
+        async with self._ingest_lock:
+            kept = [(kind, message) for kind, message in self._ingest_buffer
+                    if kind == "delete" or message.chat_id != chat_id or message.date > fetched_until]
+            dropped = len(self._ingest_buffer) - len(kept)
+            self._ingest_buffer = kept
+            self._stale_chats.discard(chat_id)
+        logger.info(
+            f"Chat ID {chat_id} caught up by fetching, dropped {dropped} unsaved message events")
+
+    async def fetch_many(self, chat_ids, filter_type, filter_value, user_timezone, user_phone, max_concurrency=FETCH_CONCURRENCY,
+                         progress_callback=None):
+        """Fetch messages from several chats concurrently, yielding (chat_id, messages) as each chat finishes.
+
+        At most max_concurrency chats are fetched at once. progress_callback, if given, is awaited with
+        (chat_id, progress) for every progress update of every chat.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def fetch_one(chat_id):
+            chat_progress = None
+            if progress_callback:
+                async def chat_progress(progress):
+                    await progress_callback(chat_id, progress)
+            async with semaphore:
+                messages = await self.get_messages(
+                    chat_id, filter_type, filter_value, user_timezone, user_phone, progress_callback=chat_progress)
+            return chat_id, messages
+
+        logger.info(
+            f"Fetching {len(chat_ids)} chats with up to {max_concurrency} concurrent fetches")
+        tasks = [asyncio.ensure_future(fetch_one(chat_id))
+                 for chat_id in chat_ids]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Stop the remaining fetches if the caller stops consuming results early
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    @contextlib.asynccontextmanager
+    async def _takeout_client(self):
+        """Yield a takeout session for bulk exports, or the regular client if one cannot be opened right now."""
+        if not hasattr(self.client, "takeout"):
+            yield self.client
+            return
+        takeout = self.client.takeout(finalize=True, users=True)
+        try:
+            client = await takeout.__aenter__()
+        except TakeoutInitDelayError as e:
+            logger.warning(
+                f"Takeout session available in {e.seconds} seconds, backfilling with the regular client")
+            yield self.client
+            return
+        try:
+            yield client
+        except BaseException as e:
+            await takeout.__aexit__(type(e), e, e.__traceback__)
+            raise
+        else:
+            await takeout.__aexit__(None, None, None)
+
+    async def backfill_history(self, chat_id, user_phone=None, batch_size=BACKFILL_BATCH_SIZE, use_takeout=True,
+                               progress_callback=None, write_mode=BACKFILL_WRITE_MODE):
+        """Store a chat's entire history, oldest to newest, committing every batch_size messages.
+
+        Progress is checkpointed after each batch, so an interrupted backfill resumes after the last committed
+        message. write_mode is passed to save_messages. Returns the number of messages stored by this run.
+        """
+        user_phone = user_phone or self.user_phone
+        state = load_backfill_state(chat_id, user_phone)
+        if state and state[1]:
+            logger.info(f"History of chat ID {chat_id} is already backfilled")
+            return 0
+        last_message_id = state[0] if state else 0
+        if last_message_id:
+            logger.info(
+                f"Resuming backfill of chat ID {chat_id} after message ID {last_message_id}")
+
+        # Keep the whole history: backfilled chats are exempt from MAX_MESSAGES_PER_CHAT
+        save_retention_policy(chat_id, user_phone)
+        saved_count = 0
+
+        async def commit(page):
+            nonlocal saved_count, last_message_id
+            rows = await self.build_message_rows(page)
+            db_session = Session()
+            try:
+                inserted, _ = save_messages(db_session, chat_id, user_phone, rows, write_mode=write_mode)
+                saved_count += inserted
+            finally:
+                db_session.close()
+            last_message_id = page[-1].id
+            save_backfill_state(chat_id, user_phone, last_message_id)
+            # The backfill runs oldest first, so everything up to this batch is stored
+            add_coverage(chat_id, user_phone, HISTORY_START,
+                         page[-1].date, None, last_message_id)
+            if progress_callback:
+                await progress_callback(saved_count)
+
+        started = datetime.now(pytz.UTC)
+        try:
+            await self.toggle_updates(False)
+            client_context = self._takeout_client() if use_takeout else contextlib.nullcontext(self.client)
+            async with client_context as client:
+                page = []
+                async for message in self.safe_iter_messages(chat_id, offset_id=last_message_id, reverse=True,
+                                                             wait_time=0, client=client):
+                    page.append(message)
+                    if len(page) >= batch_size:
+                        await commit(page)
+                        page = []
+                if page:
+                    await commit(page)
+            save_backfill_state(chat_id, user_phone,
+                                last_message_id, completed=True)
+            add_coverage(chat_id, user_phone, HISTORY_START, started,
+                         None, last_message_id or None)
+            logger.info(
+                f"Backfilled {saved_count} messages for chat ID {chat_id}")
+            return saved_count
+        except Exception as e:
+            logger.error(
+                f"Backfill of chat ID {chat_id} stopped after message ID {last_message_id}: {e}")
+            raise
         finally:
             await self.toggle_updates(True)
 
@@ -377,6 +927,7 @@ class TelegramManager:
     async def disconnect(self):
         """Disconnect from Telegram servers."""
         try:
+            await self.stop_ingestion()
             await self.client.disconnect()
             logger.info("Disconnected from Telegram")
         except Exception as e:
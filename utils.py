@@ -1,4 +1,8 @@
-from telethon.tl.types import User, Chat, Channel
+import hashlib
+from telethon.tl.types import (User, Chat, Channel, MessageMediaPhoto, MessageMediaDocument, MessageMediaGeo,
+                               MessageMediaGeoLive, MessageMediaVenue, MessageMediaContact, MessageMediaPoll,
+                               MessageMediaDice, DocumentAttributeVideo, DocumentAttributeAudio,
+                               DocumentAttributeSticker, PhotoSize, PhotoSizeProgressive, Document)
 
 
 def search_by_username(username, chats):
@@ -26,40 +30,119 @@ def get_sender_name(sender, me):
     return "Unknown"
 
 
-def get_message_content(message):
-    """Extract the content of a message in a human-readable format."""
+class MessageRow(tuple):
+    """A (sender, text, timestamp, message_id) row that also carries the message's media and last edit date."""
+
+    def __new__(cls, sender, text, timestamp, message_id, media_type=None, media_meta=None, edit_date=None):
+        row = super().__new__(cls, (sender, text, timestamp, message_id))
+        row.media_type = media_type
+        row.media_meta = media_meta or {}
+        row.edit_date = edit_date
+        return row
+
+
+def content_hash(sender, text, media_type=None, media_size=None, media_duration=None):
+    """Return a short digest of the stored content of a message, used to detect changes without comparing it."""
+    content = "\x1f".join("" if value is None else str(value)
+                           for value in (sender, text, media_type, media_size, media_duration))
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+# Placeholder text shown for messages without text, by media type
+MEDIA_LABELS = {
+    "photo": "[Photo]",
+    "video": "[Video]",
+    "document": "[Document]",
+    "sticker": "[Sticker]",
+    "audio": "[Audio]",
+    "voice": "[Voice]",
+    "location": "[Location]",
+    "contact": "[Contact]",
+    "poll": "[Poll]",
+    "dice": "[Dice]",
+}
+
+
+def _photo_media(media):
+    """Return the media type and metadata of a photo."""
+    size = None
+    photo = media.photo
+    for photo_size in getattr(photo, "sizes", None) or ():
+        if isinstance(photo_size, PhotoSize):
+            size = max(size or 0, photo_size.size)
+        elif isinstance(photo_size, PhotoSizeProgressive):
+            size = max(size or 0, max(photo_size.sizes))
+    return "photo", {"size": size} if size else {}
+
+
+def _document_media(media):
+    """Return the media type and metadata of a document, telling videos, audio and stickers apart."""
+    document = media.document
+    # Expired or deleted documents come as DocumentEmpty, without attributes
+    if not isinstance(document, Document):
+        return "document", {}
+    media_type = "document"
+    duration = None
+    for attribute in document.attributes:
+        if isinstance(attribute, DocumentAttributeSticker):
+            media_type = "sticker"
+            break
+        if isinstance(attribute, DocumentAttributeVideo):
+            media_type, duration = "video", attribute.duration
+        elif isinstance(attribute, DocumentAttributeAudio):
+            media_type = "voice" if attribute.voice else "audio"
+            duration = attribute.duration
+    meta = {"size": getattr(document, "size", None)}
+    if duration is not None:
+        meta["duration"] = int(duration)
+    return media_type, meta
+
+
+# Media extractors by Telethon media class; each returns (media_type, metadata)
+MEDIA_EXTRACTORS = {
+    MessageMediaPhoto: _photo_media,
+    MessageMediaDocument: _document_media,
+    MessageMediaGeo: lambda media: ("location", {}),
+    MessageMediaGeoLive: lambda media: ("location", {"duration": media.period}),
+    MessageMediaVenue: lambda media: ("location", {}),
+    MessageMediaContact: lambda media: ("contact", {}),
+    MessageMediaPoll: lambda media: ("poll", {}),
+    MessageMediaDice: lambda media: ("dice", {}),
+}
+
+
+def extract_message_content(message):
+    """Extract a message's text, media type and media metadata (size in bytes, duration in seconds).
+
+    The media type is None for messages without media. Messages without text get a readable placeholder.
+    """
     if not message:
-        return None
-
-    # Check for message attributes safely using hasattr
-    if hasattr(message, 'text') and message.text:
-        return message.text
-    if hasattr(message, 'photo') and message.photo:
-        return "[Photo]"
-    if hasattr(message, 'video') and message.video:
-        return "[Video]"
-    if hasattr(message, 'document') and message.document:
-        return "[Document]"
-    if hasattr(message, 'sticker') and message.sticker:
-        return "[Sticker]"
-    if hasattr(message, 'audio') and message.audio:
-        return "[Audio]"
-    if hasattr(message, 'voice') and message.voice:
-        return "[Voice]"
-    if hasattr(message, 'location') and message.location:
-        return "[Location]"
-    if hasattr(message, 'contact') and message.contact:
-        return "[Contact]"
-    if hasattr(message, 'poll') and message.poll:
-        return "[Poll]"
-    if hasattr(message, 'dice') and message.dice:
-        return "[Dice]"
-    if hasattr(message, 'action') and message.action:
-        return f"[Action: {str(message.action)}]"
-    if hasattr(message, 'fwd_from') and message.fwd_from:
-        return "[Forwarded Message]"
-    if hasattr(message, 'via_bot') and message.via_bot:
-        return "[Bot Message]"
+        return None, None, {}
+
+    media_type, media_meta = None, {}
+    media = getattr(message, "media", None)
+    if media is not None:
+        extractor = MEDIA_EXTRACTORS.get(type(media))
+        if extractor:
+            media_type, media_meta = extractor(media)
+
+    text = getattr(message, "text", None)
+    if text:
+        return text, media_type, media_meta
+    if media_type:
+        return MEDIA_LABELS[media_type], media_type, media_meta
+    action = getattr(message, "action", None)
+    if action:
+        return f"[Action: {str(action)}]", None, {}
+    if getattr(message, "fwd_from", None):
+        return "[Forwarded Message]", None, {}
+    if getattr(message, "via_bot_id", None):
+        return "[Bot Message]", None, {}
 
     # Fallback for messages with no recognizable content
-    return "[Unknown Content]"
+    return "[Unknown Content]", None, {}
+
+
+def get_message_content(message):
+    """Extract the content of a message in a human-readable format."""
+    return extract_message_content(message)[0]